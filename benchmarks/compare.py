@@ -0,0 +1,77 @@
+"""
+Compares two results of :mod:`benchmarks.run`, exits with code 1 when the second one regressed::
+
+    python -m benchmarks.compare benchmarks/results/before.json benchmarks/results/after.json --threshold 10
+"""
+
+from __future__ import annotations
+
+import sys
+import json
+import argparse
+
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+# (name, path in a scenario, whether higher is better)
+FIELDS: Tuple[Tuple[str, Tuple[str, ...], bool], ...] = (
+    ("throughput", ("throughput",), True),
+    ("p50 ms", ("latency_ms", "p50"), False),
+    ("p99 ms", ("latency_ms", "p99"), False),
+)
+
+
+def lookup(data: Dict[str, Any], path: Tuple[str, ...]) -> Optional[float]:
+    for key in path:
+        if not isinstance(data, dict) or key not in data:
+            return None
+        data = data[key]
+    return data
+
+
+def compare(before: Dict[str, Any], after: Dict[str, Any], threshold: float) -> Tuple[List[str], List[str]]:
+    """Returns the lines of the report and the regressions beyond `threshold` percent."""
+    lines, regressions = [], []
+    for scenario in after.get("scenarios", {}):
+        if scenario not in before.get("scenarios", {}):
+            continue
+        for name, path, higher_is_better in FIELDS:
+            old = lookup(before["scenarios"][scenario], path)
+            new = lookup(after["scenarios"][scenario], path)
+            if not old or new is None:
+                continue
+            change = (new - old) / old * 100
+            worse = -change if higher_is_better else change
+            line = f"{scenario:<15} {name:<11} {old:>12.3f} -> {new:>12.3f} ({change:+.1f}%)"
+            lines.append(line)
+            if worse > threshold:
+                regressions.append(line)
+    return lines, regressions
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.compare", description="Compares two benchmark results.")
+    parser.add_argument("before", help="the reference results")
+    parser.add_argument("after", help="the results to check")
+    parser.add_argument("--threshold", type=float, default=10.0, help="the percent a metric may get worse by (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+
+    print(f"{before.get('revision') or args.before} -> {after.get('revision') or args.after}")
+    config_before, config_after = before.get("config", {}), after.get("config", {})
+    if changed := sorted(key for key in {*config_before, *config_after} if config_before.get(key) != config_after.get(key)):
+        print(f"warning: the runs were not configured the same way ({', '.join(changed)})")
+    lines, regressions = compare(before, after, args.threshold)
+    print("\n".join(lines))
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) beyond {args.threshold}%:")
+        print("\n".join(regressions))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
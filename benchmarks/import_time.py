@@ -0,0 +1,77 @@
+"""
+Checks the import-time budget of the client path::
+
+    python -m benchmarks.import_time --budget-ms 30
+
+Every run is a fresh interpreter timing `from discord.ext.cluster import Client`.
+The `discord` package itself is imported first and reported apart, the
+`discord.ext` namespace makes it load discord.py's `__init__` whatever the
+library does. The check fails when the client path goes over the budget or
+loads a module only the shard or the cluster need.
+"""
+
+from __future__ import annotations
+
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+from typing import Any, Dict, List, Optional, Sequence
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# loaded by the shard or the cluster, never by a client
+FORBIDDEN = ("discord.ext.commands", "websockets", "fastapi", "uvicorn", "multiprocessing.shared_memory")
+
+PROBE = """
+import sys, time, json
+start = time.perf_counter()
+import discord
+middle = time.perf_counter()
+from discord.ext.cluster import Client
+end = time.perf_counter()
+print(json.dumps({
+    "discord_ms": (middle - start) * 1000,
+    "client_ms": (end - middle) * 1000,
+    "loaded": [name for name in %r if name in sys.modules],
+}))
+"""
+
+
+def probe() -> Dict[str, Any]:
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, [ROOT, os.environ.get("PYTHONPATH")]))}
+    output = subprocess.run(
+        [sys.executable, "-c", PROBE % (FORBIDDEN,)], cwd=ROOT, env=env, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.import_time", description="Checks the import time of the client path.")
+    parser.add_argument("--budget-ms", type=float, default=30.0, help="the median milliseconds the client path may take (default: %(default)s)")
+    parser.add_argument("--runs", type=int, default=7, help="the number of fresh interpreters timed (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    probe()  # fills the bytecode caches
+    runs: List[Dict[str, Any]] = [probe() for _ in range(args.runs)]
+    client_ms = statistics.median(run["client_ms"] for run in runs)
+    discord_ms = statistics.median(run["discord_ms"] for run in runs)
+    loaded = sorted({name for run in runs for name in run["loaded"]})
+
+    print(f"import discord                          {discord_ms:8.1f} ms (discord.py, outside the budget)")
+    print(f"from discord.ext.cluster import Client  {client_ms:8.1f} ms (budget {args.budget_ms:.1f} ms)")
+    failed = False
+    if client_ms > args.budget_ms:
+        print("the client path is over its budget")
+        failed = True
+    if loaded:
+        print(f"the client path loaded {', '.join(loaded)}")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
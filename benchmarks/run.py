@@ -0,0 +1,256 @@
+"""
+Load tests the cluster on localhost and saves the results as JSON.
+
+The cluster runs in its own process, the fake shards (see :mod:`benchmarks.stub`)
+and the client share this one. From the root of the repository::
+
+    python -m benchmarks.run --shards 4 --concurrency 64 --requests 5000
+    python -m benchmarks.compare benchmarks/results/before.json benchmarks/results/after.json
+
+Every scenario reports the p50/p90/p99 latency, the throughput and the errors,
+the results also hold the memory used by both processes.
+"""
+
+from __future__ import annotations
+
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+import platform
+import resource
+import subprocess
+import tempfile
+
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence
+
+import discord.ext.cluster
+
+from discord.ext.cluster import Client
+
+from .stub import Routes, start_shards
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SECRET_KEY = "benchmark"
+BOT_ID = 1
+SCENARIOS = ("request", "request_all", "large_response", "large_request")
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    index = min(int(round(fraction * (len(values) - 1))), len(values) - 1)
+    return values[index]
+
+
+def summarize(latencies: List[float], errors: int, elapsed: float) -> Dict[str, Any]:
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "seconds": round(elapsed, 4),
+        "throughput": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 0.50) * 1000, 3),
+            "p90": round(percentile(latencies, 0.90) * 1000, 3),
+            "p99": round(percentile(latencies, 0.99) * 1000, 3),
+            "max": round(latencies[-1] * 1000, 3) if latencies else 0.0,
+            "mean": round(sum(latencies) / len(latencies) * 1000, 3) if latencies else 0.0,
+        },
+    }
+
+
+async def drive(call: Callable[[int], Awaitable[Optional[Dict]]], total: int, concurrency: int) -> Dict[str, Any]:
+    """Runs `total` calls, `concurrency` at a time, and measures each of them."""
+    latencies: List[float] = []
+    errors = 0
+    counter = iter(range(total))
+
+    async def worker():
+        nonlocal errors
+        for index in counter:
+            start = time.perf_counter()
+            try:
+                response = await call(index)
+            except Exception:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+            if not response or int(response.get("code", 500)) != 200:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, errors, time.perf_counter() - start)
+
+
+def scenarios(client: Client, shards: int, payload_size: int) -> Dict[str, Callable[[int], Awaitable[Optional[Dict]]]]:
+    blob = "x" * payload_size
+    return {
+        "request": lambda index: client.request(BOT_ID, index % shards, "echo", value=index),
+        "request_all": lambda index: client.request_all(BOT_ID, "echo", value=index),
+        "large_response": lambda index: client.request(BOT_ID, index % shards, "blob"),
+        "large_request": lambda index: client.request(BOT_ID, index % shards, "upload", blob=blob),
+    }
+
+
+def max_rss_kb() -> int:
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return usage // 1024 if sys.platform == "darwin" else usage
+
+
+def process_rss_kb(pid: int) -> Optional[int]:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def start_cluster(args: argparse.Namespace, registry: str) -> subprocess.Popen:
+    command = [
+        sys.executable, "-m", "discord.ext.cluster.server",
+        "--host", "127.0.0.1",
+        "--port", str(args.port),
+        "--secret-key", SECRET_KEY,
+        "--registry", registry,
+        "--log-level", "warning",
+    ]
+    if args.unix_socket:
+        command += ["--unix-socket", args.unix_socket]
+    if args.uvloop is not None:
+        command.append("--uvloop" if args.uvloop else "--no-uvloop")
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, [ROOT, os.environ.get("PYTHONPATH")]))}
+    return subprocess.Popen(command, cwd=ROOT, env=env)
+
+
+async def wait_for_cluster(args: argparse.Namespace, process: subprocess.Popen, timeout: float = 15.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"The cluster exited with code {process.returncode}")
+        try:
+            if args.unix_socket:
+                _, writer = await asyncio.open_unix_connection(args.unix_socket)
+            else:
+                _, writer = await asyncio.open_connection("127.0.0.1", args.port)
+        except OSError:
+            await asyncio.sleep(0.1)
+            continue
+        writer.close()
+        return
+    raise RuntimeError("The cluster did not start in time")
+
+
+async def benchmark(args: argparse.Namespace, cluster: subprocess.Popen) -> Dict[str, Any]:
+    await wait_for_cluster(args, cluster)
+    location = {"unix_socket": args.unix_socket} if args.unix_socket else {"port": args.port}
+    shards = await start_shards(
+        args.shards, Routes(args.payload_size, args.delay), BOT_ID, secret_key=SECRET_KEY,
+        codecs=args.codecs, **location
+    )
+    client = Client(
+        secret_key=SECRET_KEY,
+        standard_port=args.port,
+        unix_socket=args.unix_socket,
+        codecs=args.codecs,
+        max_connections=args.max_connections,
+        timeout=args.timeout,
+    )
+    results: Dict[str, Any] = {}
+    try:
+        calls = scenarios(client, args.shards, args.payload_size)
+        for name in args.scenarios:
+            total = args.requests if name != "request_all" else max(args.requests // args.shards, 1)
+            await drive(calls[name], min(args.warmup, total), args.concurrency)
+            results[name] = await drive(calls[name], total, args.concurrency)
+            logging.info(
+                "%-15s %8.1f req/s  p50 %7.3f ms  p99 %7.3f ms  errors %d",
+                name, results[name]["throughput"], results[name]["latency_ms"]["p50"],
+                results[name]["latency_ms"]["p99"], results[name]["errors"],
+            )
+    finally:
+        await client.close()
+        for shard in shards:
+            await shard.disconnect()
+    return results
+
+
+def parse_args(argv: Optional[Sequence[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.run", description="Load tests the cluster on localhost.")
+    parser.add_argument("--shards", type=int, default=4, help="the number of fake shards (default: %(default)s)")
+    parser.add_argument("--concurrency", type=int, default=32, help="the requests in flight at once (default: %(default)s)")
+    parser.add_argument("--requests", type=int, default=2000, help="the requests per scenario (default: %(default)s)")
+    parser.add_argument("--warmup", type=int, default=100, help="the requests sent before measuring (default: %(default)s)")
+    parser.add_argument("--payload-size", type=int, default=256 * 1024, help="the bytes of the large payloads (default: %(default)s)")
+    parser.add_argument("--delay", type=float, default=0.0, help="seconds the echo route waits, to simulate work (default: %(default)s)")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma separated, among: " + ", ".join(SCENARIOS))
+    parser.add_argument("--codecs", help="comma separated wire codecs offered, such as json (default: every installed codec)")
+    parser.add_argument("--max-connections", type=int, default=10, help="the pooled connections per shard (default: %(default)s)")
+    parser.add_argument("--timeout", type=float, default=30.0, help="seconds before a request fails (default: %(default)s)")
+    parser.add_argument("--port", type=int, default=29999, help="the port of the cluster (default: %(default)s)")
+    parser.add_argument("--unix-socket", help="run the cluster on this Unix socket instead of TCP")
+    parser.add_argument("--uvloop", action=argparse.BooleanOptionalAction if hasattr(argparse, "BooleanOptionalAction") else "store_true", default=None, help="run the cluster on uvloop (default: when installed)")
+    parser.add_argument("--output", help="where the JSON results are saved (default: benchmarks/results/<time>.json)")
+    args = parser.parse_args(argv)
+    args.scenarios = [name for name in args.scenarios.split(",") if name]
+    if unknown := set(args.scenarios) - set(SCENARIOS):
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    args.codecs = args.codecs.split(",") if args.codecs else None
+    return args
+
+
+def main(argv: Optional[Sequence[str]] = None) -> Dict[str, Any]:
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    logging.getLogger("discord.ext.cluster").setLevel(logging.ERROR)
+    logging.getLogger("discord.ext.cluster.pool").setLevel(logging.ERROR)
+
+    with tempfile.TemporaryDirectory() as directory:
+        cluster = start_cluster(args, os.path.join(directory, "registry.json"))
+        try:
+            results = asyncio.run(benchmark(args, cluster))
+            cluster_rss = process_rss_kb(cluster.pid)
+        finally:
+            cluster.terminate()
+            cluster.wait(10)
+
+    report = {
+        "version": discord.ext.cluster.__version__,
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {
+            key: value for key, value in vars(args).items() if key not in ("output", "port")
+        },
+        "scenarios": results,
+        "memory_kb": {"client_and_shards_max_rss": max_rss_kb(), "cluster_rss": cluster_rss},
+    }
+
+    output = args.output or os.path.join(ROOT, "benchmarks", "results", time.strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    logging.info("Results saved to %s", output)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+A stand-in for the bot, so shards run without connecting to Discord.
+
+It only has what :class:`Shard` uses: the bot user, the cogs, the shard ids and the events.
+"""
+
+from __future__ import annotations
+
+import asyncio
+
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional, Tuple
+
+from discord.ext.cluster import Shard, ClientPayload
+
+
+class StubBot:
+    """|class|
+
+    A bot that is always ready and never connects.
+
+    Parameters:
+    ----------
+    user_id: `int`
+        The id the shards register with, it is the `bot_id` of the requests.
+    shard_id: `int`
+        The Discord shard this bot runs.
+    shard_count: `int`
+        The total number of Discord shards.
+    """
+
+    def __init__(self, user_id: int, shard_id: int = 0, shard_count: int = 1) -> None:
+        self.user = SimpleNamespace(id=user_id)
+        self.shard_id = shard_id
+        self.shard_count = shard_count
+        self.cogs: Dict[str, Any] = {}
+
+    async def add_cog(self, cog: Any) -> None:
+        self.cogs[type(cog).__name__] = cog
+
+    async def remove_cog(self, name: str) -> Optional[Any]:
+        return self.cogs.pop(name, None)
+
+    def is_ready(self) -> bool:
+        return True
+
+    async def wait_until_ready(self) -> None:
+        return None
+
+    def dispatch(self, event: str, *args: Any) -> None:
+        return None
+
+
+class Routes:
+    """The endpoints of the fake shards, `blob` answers with a payload of the configured size."""
+
+    def __init__(self, payload_size: int, delay: float = 0.0) -> None:
+        self.blob = "x" * payload_size
+        self.delay = delay
+
+    async def echo(self, bot: StubBot, data: ClientPayload) -> Dict:
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        return {"value": data.data.get("value")}
+
+    async def blob_route(self, bot: StubBot, data: ClientPayload) -> Dict:
+        return {"blob": self.blob}
+
+    async def upload(self, bot: StubBot, data: ClientPayload) -> Dict:
+        return {"size": len(data.data.get("blob", ""))}
+
+    def endpoints(self) -> List[Tuple[str, Any]]:
+        return [("echo", self.echo), ("blob", self.blob_route), ("upload", self.upload)]
+
+
+async def start_shards(
+    count: int, routes: Routes, bot_id: int = 1, **options: Any
+) -> List[Shard]:
+    """Connects `count` shards of the same bot, identified from `0` to `count - 1`."""
+    shards = []
+    for identifier in range(count):
+        shard = Shard(StubBot(bot_id, identifier, count), identifier, routes.endpoints(), **options)
+        await shard.connect()
+        if shard.task is None:
+            raise ConnectionError(f"Shard {identifier} could not connect to the cluster")
+        shards.append(shard)
+    return shards
@@ -14,6 +14,35 @@ __version__ = "2.0"
 __title__ = "better-cluster-fastapi"
 __author__ = "DaPandaOfficial and chredeur"
 
-from .client import Client
-from .shard import Shard
-from .objects import ClientPayload
+import importlib
+
+from typing import TYPE_CHECKING, Any, List
+
+__all__ = ("Client", "Shard", "ClientPayload", "offload", "options")
+
+# the names are imported on first use, so a web app only using `Client` does not load
+# the shard side (discord.ext.commands, websockets) nor the cluster (fastapi)
+_modules = {
+    "Client": ".client",
+    "Shard": ".shard",
+    "ClientPayload": ".objects",
+    "offload": ".routes",
+    "options": ".routes",
+}
+
+if TYPE_CHECKING:
+    from .client import Client
+    from .shard import Shard
+    from .objects import ClientPayload
+    from .routes import offload, options
+
+
+def __getattr__(name: str) -> Any:
+    if (module := _modules.get(name)) is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = globals()[name] = getattr(importlib.import_module(module, __name__), name)
+    return value
+
+
+def __dir__() -> List[str]:
+    return sorted({*globals(), *_modules})
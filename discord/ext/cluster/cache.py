@@ -0,0 +1,98 @@
+"""
+The response cache shared by the cluster and the shards.
+
+Only the routes marked with `@options(cache=ttl)` are cached, under a key made
+of their scope (bot, identifier, ...), the endpoint name and the normalized
+request data. Shards drop stale entries with :meth:`Shard.invalidate`.
+"""
+
+from __future__ import annotations
+
+import json
+import time
+
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Set, Tuple
+
+__all__ = ("ResponseCache", "cache_key", "normalize")
+
+Key = Tuple[Hashable, ...]
+
+
+def normalize(data: Any) -> str:
+    """Returns the same string for equal request data, whatever the order of its keys."""
+    return json.dumps(data, sort_keys=True, separators=(",", ":"), default=str)
+
+
+def cache_key(*scope: Hashable, data: Any = None) -> Key:
+    """Builds a cache key, the last element is always the normalized request data."""
+    return (*scope, normalize(data))
+
+
+class ResponseCache:
+    """|class|
+
+    A bounded LRU cache whose entries expire after their own TTL.
+
+    Parameters:
+    ----------
+    max_size: `int`
+        The number of entries kept before the least recently used ones are dropped (the default is `1024`).
+    """
+
+    __slots__: Tuple[str, ...] = ("max_size", "entries", "scopes", "version")
+
+    def __init__(self, max_size: int = 1024) -> None:
+        self.max_size = max_size
+        self.entries: OrderedDict[Key, Tuple[float, Any]] = OrderedDict()
+        self.scopes: Dict[Key, Set[Key]] = {}
+        # bumped by every invalidation, so a response computed before it is not stored after it
+        self.version: int = 0
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__} size={len(self.entries)} max_size={self.max_size}>"
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, key: Key) -> Optional[Any]:
+        if (entry := self.entries.get(key)) is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            self.discard(key)
+            return None
+        self.entries.move_to_end(key)
+        return value
+
+    def set(self, key: Key, value: Any, ttl: float, version: Optional[int] = None) -> None:
+        if ttl <= 0 or (version is not None and version != self.version):
+            return
+        self.entries[key] = (time.monotonic() + ttl, value)
+        self.entries.move_to_end(key)
+        self.scopes.setdefault(key[:-1], set()).add(key)
+        while len(self.entries) > self.max_size:
+            self.discard(next(iter(self.entries)))
+
+    def discard(self, key: Key) -> None:
+        if self.entries.pop(key, None) is None:
+            return
+        scope = self.scopes.get(key[:-1])
+        if scope is not None:
+            scope.discard(key)
+            if not scope:
+                del self.scopes[key[:-1]]
+
+    def invalidate(self, *scope: Hashable, data: Any = None) -> None:
+        """Drops the entry for `data`, or every entry under `scope` when no data is given."""
+        self.version += 1
+        if data is not None:
+            return self.discard(cache_key(*scope, data=data))
+        for prefix in [prefix for prefix in self.scopes if prefix[:len(scope)] == scope]:
+            for key in list(self.scopes.get(prefix, ())):
+                self.discard(key)
+
+    def clear(self) -> None:
+        self.version += 1
+        self.entries.clear()
+        self.scopes.clear()
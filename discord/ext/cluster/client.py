@@ -2,8 +2,12 @@ from __future__ import annotations
 
 import logging
 
-from .pool import Session
-from typing import Any, Dict, Optional,  Union
+from .errors import NotConnected
+from .pool import ConnectionPool
+from .tracing import Tracer, current as current_trace
+from .transport import unix_url
+from types import TracebackType
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple, Type, Union
 
 
 class Client:
@@ -15,13 +19,35 @@ class Client:
     Parameters:
     ----------
     host: :str:`str`
-        The IP adress that hosts the server (the default is `127.0.0.1`).
+        The IP adress that hosts the server (the default is `127.0.0.1`), a full url
+        such as `ws+unix:///run/cluster.sock` is used as is.
     secret_key: :str:`str`
         The authentication that is used when creating the server (the default is `None`).
     standard_port: :str:`int`
         The port for the standard server (the default is `1025`)
         
         Please keep in mind that multicast clients cannot request routes that are only allowed for standard connections!
+    max_connections: :str:`int`
+        The maximum number of pooled connections per bot and identifier (the default is `10`).
+    max_inflight: :str:`int`
+        The number of concurrent requests sharing one connection before another is opened (the default is `100`).
+    idle_timeout: :str:`float`
+        Seconds after which an unused pooled connection is closed (the default is `60`).
+    health_check_interval: :str:`float`
+        Seconds after which an idle connection is tested before being reused (the default is `30`).
+    codecs: :str:`list`
+        The wire codecs offered to the cluster, most preferred first (the default is every installed codec).
+    timeout: :str:`float`
+        The default number of seconds a request may take, `None` means no limit (the default is `None`).
+    unix_socket: :str:`str`
+        The path of the Unix socket the cluster listens on when it runs on the same machine,
+        `host` and `standard_port` are ignored then (the default is `None`).
+    shm_threshold: :str:`int`
+        Responses of at least this many bytes are read from shared memory instead of the websocket,
+        only for shards of the same machine started with `shared_memory=True` (the default is `None`, disabled).
+    tracer: :class:`Tracer`
+        Traces the requests and the batches through the cluster and the shard, their response then
+        has a `trace` with the seconds spent on each hop (the default is `None`, disabled).
     """
 
     def __init__(
@@ -29,18 +55,55 @@ class Client:
         host: str = "127.0.0.1",
         secret_key: Union[str, None] = None,
         standard_port: int = 1025,
+        max_connections: int = 10,
+        max_inflight: int = 100,
+        idle_timeout: float = 60.0,
+        health_check_interval: float = 30.0,
+        codecs: Optional[List[str]] = None,
+        timeout: Optional[float] = None,
+        unix_socket: Optional[str] = None,
+        shm_threshold: Optional[int] = None,
+        tracer: Optional[Tracer] = None,
     ) -> None:
         self.host = host
+        self.unix_socket = unix_socket
         self.standard_port = standard_port
         self.secret_key = secret_key
+        self.timeout = timeout
+        self.tracer = tracer
 
         self.logger = logging.getLogger(__name__)
+        self.pool = ConnectionPool(
+            self.url,
+            self.secret_key,
+            max_size=max_connections,
+            max_inflight=max_inflight,
+            idle_timeout=idle_timeout,
+            health_check_interval=health_check_interval,
+            codecs=codecs,
+            shm_threshold=shm_threshold,
+        )
+
+    async def __aenter__(self) -> Client:
+        return self
+
+    async def __aexit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_value: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ) -> None:
+        await self.close()
 
     def __repr__(self) -> str:
         return f"<{self.__class__.__name__} standard_port={self.standard_port!r}>"
 
     @property
     def url(self) -> str:
+        if self.unix_socket is not None:
+            return unix_url(self.unix_socket)
+        if "://" in self.host:
+            return self.host
         return f"ws://{self.host}:{self.standard_port}"
 
     async def is_alive(self, bot_id: Union[str, int], identifier: Union[str, int]) -> bool:
@@ -49,10 +112,21 @@ class Client:
         Performs a test to the connetion state
         
         """
-        async with Session(self.url, bot_id, identifier, self.secret_key) as session:
-            return await session.is_alive()
+        try:
+            session = await self.pool.get(bot_id, identifier)
+        except NotConnected:
+            return False
+        return await session.is_alive()
 
-    async def request(self, bot_id: Union[str, int], identifier: Union[str, int], endpoint: str, **kwargs: Any) -> Optional[Dict]:
+    async def request(
+        self, 
+        bot_id: Union[str, int], 
+        identifier: Union[str, int], 
+        endpoint: str, 
+        *, 
+        request_timeout: Optional[float] = None, 
+        **kwargs: Any
+    ) -> Optional[Dict]:
         """|coro|
         
         Make a request to the server process.
@@ -60,22 +134,243 @@ class Client:
         ----------
         endpoint: `str`
             The endpoint to request on the server
+        request_timeout: `float`
+            Seconds to wait before giving up with code `504`, the request is
+            cancelled on the cluster and the shard as well (the default is `Client.timeout`).
         **kwargs: `Any`
-            The data for the endpoint
+            The data for the endpoint, any name but `request_timeout`
+        """
+        return await self.__request__(bot_id, identifier, endpoint, True, request_timeout, **kwargs)
+
+    async def request_guild(
+        self, 
+        bot_id: Union[str, int], 
+        guild_id: Union[str, int], 
+        endpoint: str, 
+        *, 
+        request_timeout: Optional[float] = None, 
+        **kwargs: Any
+    ) -> Optional[Dict]:
+        """|coro|
+
+        Make a request to the shard whose bot handles the given guild, the cluster
+        picks it with `(guild_id >> 22) % shard_count` from the shards reported by each `Shard`.
+        The endpoint receives `guild_id` along with the other data.
+
+        ----------
+        guild_id: `int`
+            The guild the request is about
+        endpoint: `str`
+            The endpoint to request on the server
+        request_timeout: `float`
+            Seconds to wait before giving up with code `504` (the default is `Client.timeout`).
+        **kwargs: `Any`
+            The data for the endpoint, any name but `request_timeout`
+        """
+        return await self.__request__(bot_id, 'guild', endpoint, True, request_timeout, guild_id=guild_id, **kwargs)
+
+    async def batch(
+        self, 
+        bot_id: Union[str, int], 
+        identifier: Union[str, int], 
+        calls: List[Tuple[str, Dict[str, Any]]], 
+        timeout: Optional[float] = None
+    ) -> Optional[Dict]:
+        """|coro|
+
+        Make several requests to the same shard in one round-trip, the shard runs them concurrently.
+        The calls' responses come back in order under `responses`, each with its own `code`.
+
+            response = await client.batch(bot_id, 1, [("get_user_data", {"user_id": 1}), ("get_guild_data", {"guild_id": 2})])
+
+        ----------
+        calls: `list`
+            The `(endpoint, kwargs)` pairs to call
+        timeout: `float`
+            Seconds to wait for the whole batch before giving up with code `504` (the default is `Client.timeout`).
         """
-        async with Session(self.url, bot_id, identifier, self.secret_key) as session:
-            return await session.request(endpoint, **kwargs)
+        timeout = self.timeout if timeout is None else timeout
+
+        async def call() -> Optional[Dict]:
+            try:
+                session = await self.pool.get(bot_id, identifier)
+                return await session.batch(calls, timeout)
+            except NotConnected:
+                self.logger.warning("Pooled connection was lost, retrying the request on a new connection.")
+
+            session = await self.pool.get(bot_id, identifier)
+            return await session.batch(calls, timeout)
+
+        return await self.__traced__("batch", call)
 
-    async def request_all(self, bot_id: Union[str, int], endpoint: str, wait_response: Optional[bool]=True, **kwargs: Any) -> Optional[Dict]:
+    async def request_all(
+        self, 
+        bot_id: Union[str, int], 
+        endpoint: str, 
+        wait_response: Optional[bool] = True, 
+        *, 
+        request_timeout: Optional[float] = None, 
+        **kwargs: Any
+    ) -> Optional[Dict]:
         """|coro|
 
         Make a request to all shard in the server process.
+        Every shard in `data` comes with a `status` (`ok`, `failed`, `disconnected` or `timeout`)
+        so a partial answer can be told apart from a complete one.
+
+        ----------
+        endpoint: `str`
+            The endpoint to request on the server
+        wait_response: `bool`
+            Wait for the shards' answers, otherwise only for the cluster to send the requests (the default is `True`).
+        request_timeout: `float`
+            Shards that did not answer within this many seconds get a `timeout` status (the default is `Client.timeout`).
+        **kwargs: `Any`
+            The data for the endpoint, any name but `wait_response` and `request_timeout`
+        """
+        return await self.__request__(bot_id, 'all', endpoint, wait_response, request_timeout, **kwargs)
+
+    async def stream_all(
+        self, 
+        bot_id: Union[str, int], 
+        endpoint: str, 
+        limit: Optional[int] = None, 
+        *, 
+        request_timeout: Optional[float] = None, 
+        **kwargs: Any
+    ) -> AsyncIterator[Tuple[str, Optional[Dict]]]:
+        """|asyncgen|
+
+        Make a request to all shard in the server process and yield each
+        shard's response as soon as the cluster receives it.
+
+            async for identifier, response in client.stream_all(bot_id, "get_stats"):
+                ...
+
+        Leaving the loop early cancels the broadcast on the cluster.
 
         ----------
         endpoint: `str`
             The endpoint to request on the server
+        limit: `int`
+            Stop after this many shards answered successfully (the default is every shard).
+        request_timeout: `float`
+            Shards that did not answer within this many seconds are yielded with code `504` (the default is `Client.timeout`).
         **kwargs: `Any`
-            The data for the endpoint
+            The data for the endpoint, any name but `limit` and `request_timeout`
+        """
+        session = await self.pool.get(bot_id, 'all')
+        request_timeout = self.timeout if request_timeout is None else request_timeout
+        async for identifier, response in session.stream_all(endpoint, limit, request_timeout=request_timeout, **kwargs):
+            yield identifier, response
+
+    async def stream(
+        self, 
+        bot_id: Union[str, int], 
+        identifier: Union[str, int], 
+        endpoint: str, 
+        window: int = 16, 
+        *, 
+        request_timeout: Optional[float] = None, 
+        **kwargs: Any
+    ) -> AsyncIterator[Any]:
+        """|asyncgen|
+
+        Make a request to a route written as an async generator and yield
+        its chunks as they arrive, without holding the whole result in memory.
+
+            async for members in client.stream(bot_id, 1, "export_members", guild_id=guild_id):
+                ...
+
+        The shard only runs `window` chunks ahead of the loop, leaving the loop early cancels the route.
+        A failure is yielded as a last chunk with an `error` and its `code`.
+
+        ----------
+        endpoint: `str`
+            The endpoint to request on the server
+        window: `int`
+            The number of chunks that can be in flight at once (the default is `16`).
+        request_timeout: `float`
+            Seconds the whole stream may take (the default is `Client.timeout`).
+        **kwargs: `Any`
+            The data for the endpoint, any name but `window` and `request_timeout`
+        """
+        session = await self.pool.get(bot_id, identifier)
+        request_timeout = self.timeout if request_timeout is None else request_timeout
+        async for chunk in session.stream_response(endpoint, window, request_timeout=request_timeout, **kwargs):
+            yield chunk
+
+    async def subscribe(
+        self, 
+        bot_id: Union[str, int], 
+        *topics: str, 
+        buffer: int = 100, 
+        policy: str = "drop_oldest"
+    ) -> AsyncIterator[Tuple[str, Any]]:
+        """|asyncgen|
+
+        Subscribe to topics of a bot and yield `(topic, data)` as its shards publish
+        events with :meth:`Shard.publish`, instead of polling an endpoint.
+
+            async for topic, data in client.subscribe(bot_id, "member_join", "voice_state", policy="coalesce"):
+                ...
+
+        Events the loop does not keep up with are buffered, once `buffer` of them are waiting
+        `policy` decides which are dropped. Leaving the loop unsubscribes.
+
+        ----------
+        topics: `str`
+            The topics to subscribe to
+        buffer: `int`
+            The number of events buffered for this subscription on the cluster and on the client (the default is `100`).
+        policy: `str`
+            `drop_oldest` or `drop_newest` drop an event once the buffer is full, `coalesce` only keeps the
+            latest event of each topic (the default is `drop_oldest`).
+        """
+        session = await self.pool.get(bot_id, 'all')
+        async for topic, data in session.subscribe(list(topics), buffer, policy):
+            yield topic, data
+
+    async def __request__(
+        self, 
+        bot_id: Union[str, int], 
+        identifier: Union[str, int], 
+        endpoint: str, 
+        wait_response: Optional[bool] = True, 
+        request_timeout: Optional[float] = None, 
+        **kwargs: Any
+    ) -> Optional[Dict]:
+        request_timeout = self.timeout if request_timeout is None else request_timeout
+
+        async def call() -> Optional[Dict]:
+            try:
+                session = await self.pool.get(bot_id, identifier)
+                return await session.request(endpoint, wait_response, request_timeout=request_timeout, **kwargs)
+            except NotConnected:
+                self.logger.warning("Pooled connection was lost, retrying the request on a new connection.")
+
+            session = await self.pool.get(bot_id, identifier)
+            return await session.request(endpoint, wait_response, request_timeout=request_timeout, **kwargs)
+
+        return await self.__traced__(endpoint, call)
+
+    async def __traced__(self, endpoint: str, call: Callable[[], Awaitable[Optional[Dict]]]) -> Optional[Dict]:
+        if self.tracer is None or (trace := self.tracer.start()) is None:
+            return await call()
+        # the session picks the trace up from the context, it also covers getting a connection from the pool
+        token = current_trace.set(trace)
+        try:
+            data = await call()
+        finally:
+            current_trace.reset(token)
+        if isinstance(data, dict):
+            data["trace"] = self.tracer.finish(trace, endpoint)
+        return data
+
+    async def close(self) -> None:
+        """|coro|
+
+        Closes every pooled connection.
+
         """
-        async with Session(self.url, bot_id, 'all', self.secret_key) as session:
-            return await session.request(endpoint, wait_response, **kwargs)
+        await self.pool.close()
@@ -0,0 +1,43 @@
+from __future__ import annotations
+
+import asyncio
+
+from typing import Awaitable, Callable, Dict, Hashable, Tuple, TypeVar
+
+__all__ = ("SingleFlight",)
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """|class|
+
+    Runs one call per key at a time, the callers asking for a key that is already
+    in flight wait for that call and share its result.
+    The call is only cancelled once every caller gave up on it.
+    """
+
+    __slots__: Tuple[str, ...] = ("calls",)
+
+    def __init__(self) -> None:
+        self.calls: Dict[Hashable, Tuple[asyncio.Future, Dict[str, int]]] = {}
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__} inflight={len(self.calls)}>"
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.calls
+
+    async def run(self, key: Hashable, factory: Callable[[], Awaitable[T]]) -> T:
+        if (call := self.calls.get(key)) is None:
+            call = self.calls[key] = (asyncio.ensure_future(factory()), {"callers": 0})
+            call[0].add_done_callback(lambda _: self.calls.pop(key, None) if self.calls.get(key) is call else None)
+
+        future, state = call
+        state["callers"] += 1
+        try:
+            return await asyncio.shield(future)
+        finally:
+            state["callers"] -= 1
+            if state["callers"] == 0 and not future.done():
+                future.cancel()
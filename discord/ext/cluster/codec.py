@@ -0,0 +1,131 @@
+"""
+Wire codecs used for the binary frames exchanged with the cluster.
+
+The codec is negotiated during the websocket handshake through the
+`Sec-WebSocket-Protocol` header: the connecting side offers the codecs it
+supports in order of preference and the cluster picks the first one it knows.
+Text frames are always JSON, binary frames use the negotiated codec.
+"""
+
+from __future__ import annotations
+
+import json
+
+from typing import Any, Dict, List, Optional, Sequence, Union
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+
+SUBPROTOCOL_PREFIX = "better-cluster."
+
+Buffer = Union[bytes, bytearray, memoryview]
+
+
+class Codec:
+    """|class|
+
+    The base class for the wire codecs.
+    """
+
+    name: str = ""
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__} name={self.name!r}>"
+
+    @property
+    def subprotocol(self) -> str:
+        return f"{SUBPROTOCOL_PREFIX}{self.name}"
+
+    def dumps(self, obj: Any) -> bytes:
+        raise NotImplementedError
+
+    def loads(self, data: Buffer) -> Any:
+        raise NotImplementedError
+
+
+class JSONCodec(Codec):
+    """|class|
+
+    JSON without padding, encoded with `orjson` when it is installed.
+    """
+
+    name = "json"
+
+    def dumps(self, obj: Any) -> bytes:
+        if orjson is not None:
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+        return json.dumps(obj, separators=(",", ":")).encode()
+
+    def dumps_text(self, obj: Any) -> str:
+        if orjson is not None:
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+        return json.dumps(obj, separators=(",", ":"))
+
+    def loads(self, data: Union[Buffer, str]) -> Any:
+        if orjson is not None:
+            return orjson.loads(data)
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        return json.loads(data)
+
+
+class MsgPackCodec(Codec):
+    """|class|
+
+    MessagePack, only available when `msgpack` is installed.
+    Unlike JSON, integer keys are kept as integers.
+    """
+
+    name = "msgpack"
+
+    def dumps(self, obj: Any) -> bytes:
+        return msgpack.packb(obj, use_bin_type=True)
+
+    def loads(self, data: Buffer) -> Any:
+        return msgpack.unpackb(data, raw=False, strict_map_key=False)
+
+
+JSON = JSONCodec()
+
+CODECS: Dict[str, Codec] = {}
+if msgpack is not None:
+    CODECS[MsgPackCodec.name] = MsgPackCodec()
+CODECS[JSON.name] = JSON
+
+
+def get_codec(name: str) -> Codec:
+    """Returns the codec registered under `name`, raises `KeyError` if it is not installed."""
+    return CODECS[name]
+
+
+def subprotocols(preferred: Optional[Sequence[str]] = None) -> Optional[List[str]]:
+    """Returns the subprotocols to offer during the handshake, most preferred first.
+
+    `None` when none of the preferred codecs is installed, the connection then uses
+    JSON text frames (an empty list would send an empty header the cluster rejects).
+    """
+    names = preferred if preferred is not None else list(CODECS)
+    return [CODECS[name].subprotocol for name in names if name in CODECS] or None
+
+
+def from_subprotocol(subprotocol: Optional[str]) -> Optional[Codec]:
+    """Returns the codec selected by the handshake, `None` means plain JSON text frames."""
+    if not subprotocol or not subprotocol.startswith(SUBPROTOCOL_PREFIX):
+        return None
+    return CODECS.get(subprotocol[len(SUBPROTOCOL_PREFIX):])
+
+
+def negotiate(offered: Sequence[str]) -> Optional[str]:
+    """Picks the first offered subprotocol this process supports."""
+    for subprotocol in offered:
+        if from_subprotocol(subprotocol) is not None:
+            return subprotocol
+    return None
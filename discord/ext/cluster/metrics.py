@@ -0,0 +1,184 @@
+"""
+In-process metrics of the clients, the cluster and the shards.
+
+Every process keeps its own :data:`REGISTRY`, updating it is a couple of dict
+operations so it stays on in the hot paths. The cluster serves it on `/metrics`,
+clients and shards can expose :meth:`Metrics.render` from their own web server::
+
+    from discord.ext.cluster.metrics import CONTENT_TYPE, REGISTRY
+
+    @app.route("/metrics")
+    async def metrics():
+        return REGISTRY.render(), 200, {"Content-Type": CONTENT_TYPE}
+"""
+
+from __future__ import annotations
+
+from bisect import bisect_left
+from typing import Dict, List, Sequence, Tuple, Union
+
+__all__ = ("Counter", "Gauge", "Histogram", "Metrics", "REGISTRY", "CONTENT_TYPE", "LATENCY_BUCKETS")
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# seconds, from a cached answer to a slow route
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+Labels = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Labels, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Counter:
+    """|class|
+
+    A value that only goes up, one per combination of label values.
+    """
+
+    __slots__: Tuple[str, ...] = ("name", "documentation", "labelnames", "values")
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values: Dict[Labels, float] = {}
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__} name={self.name!r}>"
+
+    def inc(self, *labels: str, value: float = 1.0) -> None:
+        self.values[labels] = self.values.get(labels, 0.0) + value
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}" for labels, value in self.values.items()]
+
+
+class Gauge(Counter):
+    """|class|
+
+    A value that goes up and down, such as the number of requests in flight.
+    """
+
+    __slots__: Tuple[str, ...] = ()
+
+    kind = "gauge"
+
+    def dec(self, *labels: str, value: float = 1.0) -> None:
+        self.values[labels] = self.values.get(labels, 0.0) - value
+
+    def set(self, *labels: str, value: float) -> None:
+        self.values[labels] = value
+
+
+class Histogram:
+    """|class|
+
+    Counts observations in buckets, for latencies and sizes.
+
+    Parameters:
+    ----------
+    buckets: `tuple`
+        The sorted upper bounds of the buckets (the default is :data:`LATENCY_BUCKETS`).
+    """
+
+    __slots__: Tuple[str, ...] = ("name", "documentation", "labelnames", "buckets", "values")
+
+    kind = "histogram"
+
+    def __init__(
+        self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # per label values: the count of every bucket (not cumulated) then the +Inf bucket and the sum
+        self.values: Dict[Labels, List[float]] = {}
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__} name={self.name!r}>"
+
+    def observe(self, value: float, *labels: str) -> None:
+        if (state := self.values.get(labels)) is None:
+            state = self.values[labels] = [0] * (len(self.buckets) + 2)
+        state[bisect_left(self.buckets, value)] += 1
+        state[-1] += value
+
+    def samples(self) -> List[str]:
+        lines = []
+        for labels, state in self.values.items():
+            total = 0
+            for bound, count in zip((*self.buckets, "+Inf"), state):
+                total += count
+                le = 'le="{}"'.format(bound if isinstance(bound, str) else _number(bound))
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {total}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(state[-1])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {total}")
+        return lines
+
+
+Metric = Union[Counter, Gauge, Histogram]
+
+
+class Metrics:
+    """|class|
+
+    The metrics of a process, rendered in the Prometheus text format.
+    Asking twice for the same name returns the same metric.
+    """
+
+    __slots__: Tuple[str, ...] = ("metrics",)
+
+    def __init__(self) -> None:
+        self.metrics: Dict[str, Metric] = {}
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__} metrics={len(self.metrics)}>"
+
+    def register(self, metric: Metric) -> Metric:
+        return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(
+        self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS
+    ) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics.values():
+            # every module registers its metrics on import, only the ones this process uses are shown
+            if not metric.values:
+                continue
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+    def clear(self) -> None:
+        """Resets every value, the metrics stay registered."""
+        for metric in self.metrics.values():
+            metric.values.clear()
+
+
+REGISTRY = Metrics()
@@ -3,28 +3,89 @@ from __future__ import annotations  # type: ignore
 import time
 import asyncio
 import logging
+import itertools
 
 from types import TracebackType
-from typing import Any, Dict, Optional, Type, Union
-from aiohttp import ClientConnectorError, ClientConnectionError, ClientSession, WSCloseCode, WSMsgType, ClientWebSocketResponse
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple, Type, Union
+from aiohttp import ClientConnectorError, ClientConnectionError, ClientSession, WSMessage, WSMsgType, ClientWebSocketResponse, UnixConnector
+
+from .codec import JSON, Codec, from_subprotocol, subprotocols
+from .errors import NotConnected
+from .metrics import REGISTRY
+from .protocol import pack, unpack
+from .pubsub import EventBuffer
+from .tracing import current as current_trace, mark
+from .transport import split_unix_url
+
+# the cluster answers expired requests itself (with partial results for broadcasts),
+# the client only stops waiting on its own if that answer does not come shortly after
+DEADLINE_GRACE = 1.0
+
+REQUEST_SECONDS = REGISTRY.histogram("cluster_client_request_seconds", "Time until the cluster answered a request.", ("endpoint",))
+INFLIGHT = REGISTRY.gauge("cluster_client_inflight_requests", "Requests waiting for the cluster.", ("endpoint",))
+SENT_BYTES = REGISTRY.counter("cluster_client_sent_bytes_total", "Bytes sent to the cluster.")
+RECEIVED_BYTES = REGISTRY.counter("cluster_client_received_bytes_total", "Bytes received from the cluster.")
+TIMEOUTS = REGISTRY.counter("cluster_client_timeouts_total", "Requests that timed out.", ("endpoint",))
+ERRORS = REGISTRY.counter("cluster_client_errors_total", "Requests answered with a 5xx code other than 504.", ("endpoint", "code"))
+
+
+def record(endpoint: str, data: Dict[str, Any]) -> None:
+    code = int(data.get("code", 500))
+    if code == 504:
+        TIMEOUTS.inc(endpoint)
+    elif code >= 500:
+        ERRORS.inc(endpoint, str(code))
+
+
+def client_session(url: str) -> ClientSession:
+    """Returns a session able to reach `url`, going through a Unix socket for `ws+unix://` urls."""
+    _, path = split_unix_url(url)
+    return ClientSession() if path is None else ClientSession(connector=UnixConnector(path=path))
 
 
 class Session:
-    def __init__(self, url: str, bot_id: Union[str, int], identifier: Union[str, int], secret_key: Optional[str] = None) -> None:
+    """|class|
+
+    A single websocket connection to the cluster. Every request is tagged with a
+    `request_id` and a background reader resolves the matching future, so many
+    requests can be in flight on the same connection.
+    """
+
+    def __init__(
+        self, 
+        url: str, 
+        bot_id: Union[str, int], 
+        identifier: Union[str, int], 
+        secret_key: Optional[str] = None, 
+        codecs: Optional[List[str]] = None,
+        shm_threshold: Optional[int] = None
+    ) -> None:
         self.url = url
         self.secret_key = secret_key
         self.bot_id = bot_id
         self.identifier = identifier
+        self.codecs = codecs
+        self.codec: Optional[Codec] = None
+        self.shm_threshold = shm_threshold
 
         self.logger = logging.getLogger(__name__)
         self.session: Optional[ClientSession] = None
         self.ws: Optional[ClientWebSocketResponse] = None
-    
+        self.owns_session: bool = True
+        self.reader: Optional[asyncio.Task] = None
+        self.pending: Dict[str, asyncio.Future] = {}
+        self.streams: Dict[str, Union[asyncio.Queue, EventBuffer]] = {}
+        self.counter: Iterator[int] = itertools.count()
+        self.last_used: float = time.monotonic()
+        self.last_checked: float = self.last_used
+
     def __repr__(self) -> str:
-        return f"<{self.__class__.__name__} started={True if self.session else False} ws={self.ws}>"
+        return f"<{self.__class__.__name__} started={True if self.session else False} ws={self.ws} inflight={self.inflight}>"
 
     async def __aenter__(self) -> Session:
-        await self.__init_socket__(ClientSession())
+        await self.__init_socket__(client_session(self.url))
+        if self.closed:
+            raise NotConnected
         return self
 
     async def __aexit__(
@@ -35,13 +96,23 @@ class Session:
     ) -> None:
         await self.close()
 
-    async def __init_socket__(self, session: ClientSession) -> None:
+    @property
+    def closed(self) -> bool:
+        return self.ws is None or self.ws.closed
+
+    @property
+    def inflight(self) -> int:
+        return len(self.pending) + len(self.streams)
+
+    async def __init_socket__(self, session: ClientSession, owns_session: bool = True) -> None:
         self.logger.debug("Initiating websocket connection")
         self.session = session
+        self.owns_session = owns_session
         try:
             self.ws = await self.session.ws_connect(
-                self.url,
+                split_unix_url(self.url)[0],
                 autoclose=False,
+                protocols=subprotocols(self.codecs),
                 headers={
                     "Endpoints": "create_request",
                     "Secret-Key": str(self.secret_key),
@@ -50,90 +121,551 @@ class Session:
                 }
             )
         except (ClientConnectionError, ClientConnectorError):
-            await self.session.close()
+            self.ws = None
+            if self.owns_session:
+                await self.session.close()
             return self.logger.error("WebSocket connection failed, the server is unreachable.")
 
+        self.codec = from_subprotocol(self.ws.protocol)
         if await self.is_alive():
             self.logger.debug(f"Client connected to {self.url!r}")
+            self.reader = asyncio.create_task(self.read_responses())
         else:
-            await self.session.close()
+            await self.close()
             return self.logger.error("WebSocket connection failed, the server is unreachable.")
-    
-    async def __retry__(self, endpoint, **kwargs) -> WSCloseCode:
-        payload = {
-            "endpoint": endpoint,
-            "data": kwargs
-        }
+
+    async def read_responses(self) -> None:
+        try:
+            async for message in self.ws:
+                if message.type is WSMsgType.ERROR:
+                    self.logger.error("Received WSMsgType of ERROR, instead of TEXT/BYTES!")
+                    break
+
+                RECEIVED_BYTES.inc(value=len(message.data))
+                data = self.decode(message)
+                self.logger.debug("Receiving response: %r", data)
+
+                request_id = data.pop("request_id", None)
+                if (queue := self.streams.get(request_id)) is not None:
+                    queue.put_nowait(data)
+                    continue
+
+                if request_id is None and self.pending:
+                    # servers that do not echo the id answer in order
+                    request_id = next(iter(self.pending))
+
+                future = self.pending.pop(request_id, None)
+                if future is not None and not future.done():
+                    future.set_result(data)
+        finally:
+            for future in self.pending.values():
+                if not future.done():
+                    future.set_exception(NotConnected())
+            self.pending.clear()
+            for queue in self.streams.values():
+                queue.put_nowait(None)
+            if not self.closed:
+                await self.ws.close()
+
+    def decode(self, message: WSMessage) -> Dict[str, Any]:
+        if message.type is WSMsgType.TEXT or self.codec is None:
+            return JSON.loads(message.data)
+
+        header, raw = unpack(message.data)
+        if "shm" in header:
+            # only imported by the clients reading from shared memory
+            from .shm import read as read_shared
+
+            try:
+                body = read_shared(header.pop("shm"))
+            except FileNotFoundError:
+                body = {"error": "The response expired before it could be read!", "code": 504}
+        else:
+            body = self.codec.loads(raw) if raw else None
+        if "identifier" in header:
+            # a single shard's answer to a broadcast
+            header["response"] = body
+            return header
+        return {**(body or {}), **header}
+
+    async def write(self, header: Dict[str, Any], body: Optional[Any] = None) -> None:
+        self.last_used = time.monotonic()
+        try:
+            if self.codec is not None:
+                frame = pack(header, b"" if body is None else self.codec.dumps(body))
+                await self.ws.send_bytes(frame)
+            elif body is None:
+                frame = JSON.dumps_text(header)
+                await self.ws.send_str(frame)
+            else:
+                request = dict(header)
+                message = {key: request.pop(key) for key in ("endpoint_choosen", "request_id") if key in request}
+                message["response"] = {**request, "kwargs": body}
+                frame = JSON.dumps_text(message)
+                await self.ws.send_str(frame)
+            SENT_BYTES.inc(value=len(frame))
+        except ConnectionResetError:
+            self.logger.error(
+                "Cannot write to closing transport. "
+                "(Could be raised if the client is on different machine that the server)"
+            )
+            raise NotConnected
+
+    async def send(self, header: Dict[str, Any], body: Optional[Any] = None, timeout: Optional[float] = None) -> Dict[str, Any]:
+        if self.closed:
+            raise NotConnected
+
+        request_id = str(next(self.counter))
+        header["request_id"] = request_id
+        if self.shm_threshold is not None and self.codec is not None:
+            # responses at least this large are read from shared memory, only binary frames carry the descriptor
+            header["shm"] = self.shm_threshold
+        if timeout is not None:
+            # an absolute deadline, so every hop knows when the caller gives up
+            header["deadline"] = time.time() + timeout
+
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = future
+        # health checks are left out of the metrics and the traces
+        endpoint = None if "connection_test" in header else header.get("endpoint", "batch")
+        if (trace := current_trace.get()) is not None and endpoint is not None:
+            mark(trace, "client", "sent")
+            header["trace"] = trace
+        if endpoint is not None:
+            INFLIGHT.inc(endpoint)
+            start = time.perf_counter()
+        try:
+            await self.write(header, body)
+            data = await asyncio.wait_for(future, None if timeout is None else timeout + DEADLINE_GRACE)
+            if endpoint is not None:
+                record(endpoint, data)
+                if trace is not None:
+                    # the hops the request went through marked the trace on the way
+                    trace["marks"] = (data.pop("trace", None) or trace)["marks"]
+                    mark(trace, "client", "received")
+            return data
+        except asyncio.TimeoutError:
+            if endpoint is not None:
+                TIMEOUTS.inc(endpoint)
+            await self.cancel(request_id)
+            raise
+        finally:
+            self.pending.pop(request_id, None)
+            if endpoint is not None:
+                INFLIGHT.dec(endpoint)
+                REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint)
+
+    async def cancel(self, request_id: str) -> None:
+        if self.closed:
+            return
+        try:
+            await self.write({"endpoint_choosen": "cancel_request", "request_id": request_id})
+        except NotConnected:
+            pass
+
+    async def stream(
+        self, 
+        header: Dict[str, Any], 
+        body: Optional[Any] = None, 
+        yield_error: bool = False, 
+        queue: Optional[EventBuffer] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """|asyncgen|
+
+        Sends a request that is answered with several frames and yields them as they arrive.
+        The last frame has no `identifier`, it is only yielded when it carries an error and
+        `yield_error` is set. If the iteration is stopped before it was received the request
+        is cancelled on the cluster. The frames wait in `queue` (the default is unbounded).
+        """
+        if self.closed:
+            raise NotConnected
+
+        request_id = header.setdefault("request_id", str(next(self.counter)))
+
+        if queue is None:
+            queue = asyncio.Queue()
+        self.streams[request_id] = queue
+        finished = False
+        # subscriptions stay open as long as the caller listens, they are left out of the request metrics
+        endpoint = None if header.get("endpoint_choosen") == "subscribe" else header.get("endpoint")
+        if endpoint is not None:
+            INFLIGHT.inc(endpoint)
+            start = time.perf_counter()
         try:
-            await self.ws.send_json(payload)
-        except Exception as e:
-            self.logger.error("Failed to send payload", exc_info=e)
-            return WSCloseCode.INTERNAL_ERROR
-        return WSCloseCode.OK
+            await self.write(header, body)
+            while True:
+                data = await queue.get()
+                if data is None:
+                    raise NotConnected
+                if "identifier" not in data:
+                    finished = True
+                    if endpoint is not None:
+                        record(endpoint, data)
+                    if int(data.get("code", 500)) != 200:
+                        self.logger.warning(f"Received code {data.get('code')!r} insted of usual 200")
+                        if yield_error:
+                            yield data
+                    return
+                yield data
+        finally:
+            self.streams.pop(request_id, None)
+            if endpoint is not None:
+                INFLIGHT.dec(endpoint)
+                REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint)
+            if not finished:
+                await self.cancel(request_id)
 
     async def is_alive(self) -> bool:
         payload = {"connection_test": True}
 
         start = time.perf_counter()
-        await self.ws.send_json(payload)
-        r = await self.ws.receive()
+        if self.reader is None:
+            try:
+                await self.write(payload)
+            except NotConnected:
+                return False
+            r = await self.ws.receive()
+            alive = r.type not in (WSMsgType.CLOSE, WSMsgType.CLOSING, WSMsgType.CLOSED, WSMsgType.ERROR)
+        else:
+            try:
+                await self.send(payload)
+            except NotConnected:
+                alive = False
+            else:
+                alive = True
         self.logger.debug(f"Connection to websocket took {time.perf_counter() - start:,} seconds")
 
-        if r.type in (WSMsgType.CLOSE, WSMsgType.CLOSED):
-            return False
-        return True
+        self.last_checked = time.monotonic()
+        return alive
 
-    async def request(self, endpoint: str, wait_response: Optional[bool] = True, **kwargs) -> Optional[Dict[str, Any]]:
+    async def request(
+        self, 
+        endpoint: str, 
+        wait_response: Optional[bool] = True, 
+        *, 
+        request_timeout: Optional[float] = None, 
+        guild_id: Optional[Union[str, int]] = None, 
+        **kwargs
+    ) -> Optional[Dict[str, Any]]:
         """|coro|
         Make a request to the IPC server process.
         Parameters
         ----------
         endpoint: `str`
             The endpoint to request on the server
+        request_timeout: `float`
+            Seconds to wait for the response, the cluster and the shard
+            give up on the request once it passes (the default is no limit)
+        guild_id: `int`
+            Also given to the endpoint, the cluster uses it to pick the shard
+            when the session identifier is `guild`
         **kwargs
             The data to send to the endpoint
+
+        Raises
+        ------
+        NotConnected
+            The connection was lost before a response could be read,
+            the request can be retried on a new session.
         """
         self.logger.debug(f"Sending request to {endpoint!r} with %r", kwargs)
 
-        payload = {
+        header = {
             "endpoint_choosen": "create_request",
-            "response": {
-                "endpoint": endpoint,
-                "wait_finish": wait_response,
-                "kwargs": {**kwargs}
-            }
+            "endpoint": endpoint,
+            "wait_finish": wait_response,
         }
+        if guild_id is not None:
+            header["guild_id"] = kwargs["guild_id"] = guild_id
 
         try:
-            await self.ws.send_json(payload)
-        except ConnectionResetError:
-            self.logger.error(
-                "Cannot write to closing transport, restarting the connection in 3 seconds. "
-                "(Could be raised if the client is on different machine that the server)"
-            )
-            
-            return await self.__retry__(endpoint, **kwargs)
+            data = await self.send(header, kwargs, request_timeout)
+        except asyncio.TimeoutError:
+            self.logger.warning(f"Request to {endpoint!r} timed out after {request_timeout} seconds")
+            return {"error": "The request timed out!", "code": 504}
+        if int(data.get("code", 500)) != 200:
+            self.logger.warning(f"Received code {data.get('code')!r} insted of usual 200")
+        return data
+
+    async def batch(
+        self, 
+        calls: List[Tuple[str, Dict[str, Any]]], 
+        timeout: Optional[float] = None
+    ) -> Optional[Dict[str, Any]]:
+        """|coro|
+        Make several requests to the same shard in a single frame.
+        Parameters
+        ----------
+        calls: `list`
+            The `(endpoint, kwargs)` pairs to call, the shard runs them concurrently
+        timeout: `float`
+            Seconds to wait for the whole batch (the default is no limit)
+        """
+        self.logger.debug(f"Sending a batch of {len(calls)} requests")
+
+        header = {
+            "endpoint_choosen": "create_request",
+            "batch": True,
+        }
+        body = {"calls": [{"endpoint": endpoint, "data": kwargs} for endpoint, kwargs in calls]}
+
+        try:
+            data = await self.send(header, body, timeout)
+        except asyncio.TimeoutError:
+            self.logger.warning(f"Batch of {len(calls)} requests timed out after {timeout} seconds")
+            return {"error": "The request timed out!", "code": 504}
+        if int(data.get("code", 500)) != 200:
+            self.logger.warning(f"Received code {data.get('code')!r} insted of usual 200")
+        return data
 
-        recv = await self.ws.receive()
+    async def stream_response(
+        self, 
+        endpoint: str, 
+        window: int = 16, 
+        *, 
+        request_timeout: Optional[float] = None, 
+        **kwargs
+    ) -> AsyncIterator[Any]:
+        """|asyncgen|
+        Make a request to a route that streams its response and yield the chunks in order.
+        The shard sends at most `window` chunks ahead of the ones already consumed, the
+        consumed ones are acknowledged by half a window at a time.
+        A failure is yielded as a last chunk with an `error` and its `code`.
+        Parameters
+        ----------
+        endpoint: `str`
+            The endpoint to request on the server
+        window: `int`
+            The number of chunks the shard may send before waiting for the client
+        request_timeout: `float`
+            Seconds the whole stream may take (the default is no limit)
+        **kwargs
+            The data to send to the endpoint
+        """
+        self.logger.debug(f"Streaming response of {endpoint!r} with %r", kwargs)
+
+        request_id = str(next(self.counter))
+        header = {
+            "endpoint_choosen": "create_request",
+            "endpoint": endpoint,
+            "request_id": request_id,
+            "stream_window": window,
+        }
+        if request_timeout is not None:
+            header["deadline"] = time.time() + request_timeout
 
-        self.logger.debug("Receiving response: %r", recv)
+        consumed = 0
+        async for data in self.stream(header, kwargs, yield_error=True):
+            if "identifier" not in data:
+                yield data
+                return
+            yield data.get("response")
+            consumed += 1
+            if consumed >= max(window // 2, 1):
+                await self.write({"endpoint_choosen": "stream_credit", "request_id": request_id, "credit": consumed})
+                consumed = 0
 
-        if recv.type is WSMsgType.CLOSED:
-            self.logger.error("WebSocket connection unexpectedly closed, attempting to retry in 3 seconds.")
-            await asyncio.sleep(3)
+    async def stream_all(
+        self, 
+        endpoint: str, 
+        limit: Optional[int] = None, 
+        *, 
+        request_timeout: Optional[float] = None, 
+        **kwargs
+    ) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        """|asyncgen|
+        Make a request to all shards and yield `(identifier, response)` as each shard answers.
+        Shards that did not answer are yielded with an error response carrying their `status`.
+        Parameters
+        ----------
+        endpoint: `str`
+            The endpoint to request on the server
+        limit: `int`
+            Stop once this many shards answered successfully
+        request_timeout: `float`
+            Shards that did not answer within this many seconds are yielded with a `timeout` status
+        **kwargs
+            The data to send to the endpoint
+        """
+        self.logger.debug(f"Streaming request to {endpoint!r} with %r", kwargs)
 
-            if await self.__retry__(endpoint, **kwargs) == WSCloseCode.INTERNAL_ERROR:
-                self.logger.error("Could not do perform the request after reattempt")
+        header = {
+            "endpoint_choosen": "create_request",
+            "endpoint": endpoint,
+            "wait_finish": True,
+            "stream": True,
+            "limit": limit,
+        }
+        if request_timeout is not None:
+            header["deadline"] = time.time() + request_timeout
 
-        elif recv.type is WSMsgType.ERROR:
-            self.logger.error("Received WSMsgType of ERROR, instead of TEXT/BYTES!")
+        async for data in self.stream(header, kwargs):
+            status = data.get("status")
+            if status == "ok":
+                yield data["identifier"], data.get("response")
+            else:
+                yield data["identifier"], {"error": f"Shard status is {status!r}", "status": status, "code": 504 if status == "timeout" else 503}
 
-        else:
-            data = recv.json()
-            if int(data["code"]) != 200:
-                self.logger.warning(f"Received code {data['code']!r} insted of usual 200")
-            return data
+    async def subscribe(
+        self, 
+        topics: List[str], 
+        buffer: int = 100, 
+        policy: str = "drop_oldest"
+    ) -> AsyncIterator[Tuple[str, Any]]:
+        """|asyncgen|
+        Subscribe to topics of the bot and yield `(topic, data)` for every event its shards publish.
+        The cluster and this session each buffer up to `buffer` events the loop did not consume yet,
+        `policy` decides which are dropped once they are full, see :mod:`discord.ext.cluster.pubsub`.
+        Leaving the loop unsubscribes.
+        Parameters
+        ----------
+        topics: `list`
+            The topics to subscribe to
+        buffer: `int`
+            The number of events buffered on each side
+        policy: `str`
+            `drop_oldest`, `drop_newest` or `coalesce`
+        """
+        self.logger.debug(f"Subscribing to {topics!r}")
+
+        queue = EventBuffer(buffer, policy)
+        header = {"endpoint_choosen": "subscribe", "topics": list(topics), "buffer": buffer, "policy": policy}
+        async for data in self.stream(header, queue=queue):
+            yield data["topic"], data.get("response")
+
+    async def close(self) -> None:
+        if self.reader is not None and self.reader is not asyncio.current_task():
+            self.reader.cancel()
+        if self.ws is not None:
+            await self.ws.close()
+        if self.session is not None and self.owns_session:
+            await self.session.close()
+
+
+class ConnectionPool:
+    """|class|
+
+    Keeps long-lived, already handshaken :class:`Session` objects for every
+    `(bot_id, identifier)` pair, so a request does not pay for a new socket.
+    Sessions are shared between concurrent requests, a new one is only opened
+    when every existing session already carries `max_inflight` requests.
+
+    Parameters:
+    ----------
+    url: `str`
+        The url of the cluster, `ws+unix://` urls go through a Unix socket.
+    secret_key: `str`
+        The authentication that is used when creating the server.
+    max_size: `int`
+        The maximum number of connections kept for a single `(bot_id, identifier)` pair.
+    max_inflight: `int`
+        The number of concurrent requests on a connection before another one is opened.
+    idle_timeout: `float`
+        Connections that were not used for this many seconds are closed.
+    health_check_interval: `float`
+        Idle connections older than this many seconds are tested before being reused.
+    codecs: `list`
+        The wire codecs offered to the cluster, most preferred first (the default is every installed codec).
+    shm_threshold: `int`
+        Responses of at least this many bytes are read from shared memory (the default is `None`, disabled).
+    """
+
+    def __init__(
+        self,
+        url: str,
+        secret_key: Optional[str] = None,
+        max_size: int = 10,
+        max_inflight: int = 100,
+        idle_timeout: float = 60.0,
+        health_check_interval: float = 30.0,
+        codecs: Optional[List[str]] = None,
+        shm_threshold: Optional[int] = None,
+    ) -> None:
+        self.url = url
+        self.secret_key = secret_key
+        self.max_size = max_size
+        self.max_inflight = max_inflight
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self.codecs = codecs
+        self.shm_threshold = shm_threshold
+
+        self.logger = logging.getLogger(__name__)
+        self.session: Optional[ClientSession] = None
+        self.connections: Dict[Tuple[str, str], List[Session]] = {}
+        self.locks: Dict[Tuple[str, str], asyncio.Lock] = {}
+        self.reaper: Optional[asyncio.Task] = None
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__} url={self.url!r} connections={sum(len(x) for x in self.connections.values())}>"
+
+    async def connect(self, bot_id: Union[str, int], identifier: Union[str, int]) -> Session:
+        if self.session is None or self.session.closed:
+            self.session = client_session(self.url)
+        if self.reaper is None or self.reaper.done():
+            self.reaper = asyncio.create_task(self.reap_idle())
+
+        session = Session(self.url, bot_id, identifier, self.secret_key, self.codecs, self.shm_threshold)
+        await session.__init_socket__(self.session, owns_session=False)
+        if session.closed:
+            raise NotConnected
+        return session
+
+    def pick(self, key: Tuple[str, str]) -> Optional[Session]:
+        connections = self.connections.get(key)
+        if not connections:
+            return None
+        connections[:] = [x for x in connections if not x.closed]
+        best = min(connections, key=lambda x: x.inflight, default=None)
+        if best is not None and (best.inflight < self.max_inflight or len(connections) >= self.max_size):
+            return best
+        return None
+
+    async def get(self, bot_id: Union[str, int], identifier: Union[str, int]) -> Session:
+        """|coro|
+
+        Returns the least busy connected session, opening a new one if needed.
+
+        """
+        key = (str(bot_id), str(identifier))
+        while (session := self.pick(key)) is not None:
+            stale = not session.inflight and time.monotonic() - session.last_checked > self.health_check_interval
+            if not stale or await session.is_alive():
+                return session
+            await session.close()
+
+        if key not in self.locks:
+            self.locks[key] = asyncio.Lock()
+        async with self.locks[key]:
+            if (session := self.pick(key)) is not None:
+                return session
+            session = await self.connect(bot_id, identifier)
+            self.connections.setdefault(key, []).append(session)
+            return session
+
+    async def reap_idle(self) -> None:
+        while True:
+            await asyncio.sleep(max(self.idle_timeout / 2, 1))
+            now = time.monotonic()
+            expired = []
+            for key, connections in list(self.connections.items()):
+                for session in list(connections):
+                    if session.closed or (not session.inflight and now - session.last_used > self.idle_timeout):
+                        connections.remove(session)
+                        expired.append(session)
+                if not connections:
+                    del self.connections[key]
+            for session in expired:
+                await session.close()
 
     async def close(self) -> None:
-        await self.ws.close()
-        await self.session.close()
+        if self.reaper is not None:
+            self.reaper.cancel()
+            self.reaper = None
+        for connections in self.connections.values():
+            for session in connections:
+                await session.close()
+        self.connections.clear()
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
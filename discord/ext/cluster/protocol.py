@@ -0,0 +1,80 @@
+"""
+The routing envelope used by binary frames.
+
+A binary frame is a 4 bytes big-endian header length, a small JSON header
+carrying the routing information (`uuid`, `identifier`, `endpoint`, ...) and
+the body encoded with the codec negotiated for the connection::
+
+    | header length | header (JSON) | body (codec) |
+
+The cluster only reads and rewrites the header, the body bytes are forwarded
+untouched unless both sides negotiated a different codec.
+"""
+
+from __future__ import annotations
+
+import struct
+
+from typing import Any, Dict, Optional, Tuple
+
+from .codec import JSON, Buffer, Codec
+
+__all__ = ("Body", "pack", "unpack")
+
+HEADER_SIZE = struct.Struct("!I")
+
+_MISSING: Any = object()
+
+
+def pack(header: Dict[str, Any], body: Buffer = b"") -> bytes:
+    """Builds a binary frame out of a header and already encoded body bytes."""
+    raw = JSON.dumps(header)
+    return b"".join((HEADER_SIZE.pack(len(raw)), raw, body))
+
+
+def unpack(frame: Buffer) -> Tuple[Dict[str, Any], memoryview]:
+    """Splits a binary frame, the body is returned as a view over the frame."""
+    view = memoryview(frame)
+    (size,) = HEADER_SIZE.unpack_from(view)
+    start = HEADER_SIZE.size
+    return JSON.loads(view[start:start + size]), view[start + size:]
+
+
+class Body:
+    """|class|
+
+    A message body that is only decoded or re-encoded when it is needed.
+
+    Parameters:
+    ----------
+    value: `Any`
+        The decoded body.
+    raw: `bytes`
+        The encoded body.
+    codec: :class:`Codec`
+        The codec `raw` is encoded with.
+    """
+
+    __slots__: Tuple[str, ...] = ("value", "raw", "codec")
+
+    def __init__(self, value: Any = _MISSING, raw: Optional[Buffer] = None, codec: Optional[Codec] = None) -> None:
+        self.value = value
+        self.raw = raw
+        self.codec = codec
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__} decoded={self.value is not _MISSING} codec={self.codec!r}>"
+
+    def __len__(self) -> int:
+        return len(self.raw) if self.raw is not None else 0
+
+    def decode(self) -> Any:
+        if self.value is _MISSING:
+            self.value = self.codec.loads(self.raw) if self.raw else None
+        return self.value
+
+    def encode(self, codec: Codec) -> Buffer:
+        if self.raw is not None and self.codec is codec:
+            return self.raw
+        value = self.decode()
+        return b"" if value is None else codec.dumps(value)
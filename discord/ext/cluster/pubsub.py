@@ -0,0 +1,92 @@
+"""
+The buffers of the topics shards publish events to.
+
+A client subscribes to topics of a bot through the cluster, the events its shards
+publish with :meth:`Shard.publish` are then pushed to it instead of being polled.
+Every subscriber has a bounded buffer on the cluster and another one in the client,
+once a slow subscriber filled it the policy of its subscription decides what is lost:
+
+- `drop_oldest` drops the oldest buffered event to make room for the new one.
+- `drop_newest` drops the new event.
+- `coalesce` keeps only the latest event of each topic, for topics carrying a state
+  where only the last value matters, the oldest topic is dropped to make room for a new one.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import itertools
+
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Iterator, Optional, Tuple
+
+__all__ = ("EventBuffer", "POLICIES")
+
+POLICIES = ("drop_oldest", "drop_newest", "coalesce")
+
+
+class EventBuffer:
+    """|class|
+
+    A bounded queue of events applying the policy of a subscription once it is full.
+    `None` and the items without a topic (the end of a subscription, an error) are
+    never dropped.
+
+    Parameters:
+    ----------
+    size: `int`
+        The number of events the buffer holds (the default is `100`).
+    policy: `str`
+        `drop_oldest`, `drop_newest` or `coalesce` (the default is `drop_oldest`).
+    topic: `Callable`
+        Returns the topic of an item (the default reads its `topic` key).
+    """
+
+    __slots__: Tuple[str, ...] = ("size", "policy", "topic", "items", "ends", "counter", "dropped", "ready")
+
+    def __init__(self, size: int = 100, policy: str = "drop_oldest", topic: Optional[Callable[[Any], Optional[str]]] = None) -> None:
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown policy {policy!r}, expected one of {', '.join(POLICIES)}")
+        if size < 1:
+            raise ValueError("The buffer must hold at least one event")
+        self.size = size
+        self.policy = policy
+        self.topic = topic or (lambda item: item.get("topic"))
+        # ("event", n) for the events, ("topic", topic) when they are coalesced, ("end", n) for the rest
+        self.items: OrderedDict[Tuple[str, Hashable], Any] = OrderedDict()
+        self.ends = 0
+        self.counter: Iterator[int] = itertools.count()
+        self.dropped = 0
+        self.ready = asyncio.Event()
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__} size={self.size} policy={self.policy!r} buffered={len(self.items)} dropped={self.dropped}>"
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def put_nowait(self, item: Any) -> None:
+        if item is None or (topic := self.topic(item)) is None:
+            self.items[("end", next(self.counter))] = item
+            self.ends += 1
+        elif self.policy == "coalesce" and ("topic", topic) in self.items:
+            # the pending event of the topic is replaced, it keeps its place in the queue
+            self.items[("topic", topic)] = item
+            self.dropped += 1
+        else:
+            if len(self.items) - self.ends >= self.size:
+                self.dropped += 1
+                if self.policy == "drop_newest":
+                    return
+                del self.items[next(key for key in self.items if key[0] != "end")]
+            self.items[("topic", topic) if self.policy == "coalesce" else ("event", next(self.counter))] = item
+        self.ready.set()
+
+    async def get(self) -> Any:
+        while not self.items:
+            self.ready.clear()
+            await self.ready.wait()
+        key, item = self.items.popitem(last=False)
+        if key[0] == "end":
+            self.ends -= 1
+        return item
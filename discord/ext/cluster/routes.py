@@ -0,0 +1,53 @@
+from __future__ import annotations
+
+from typing import Any, Callable, Dict, Sequence, TypeVar
+
+__all__ = ("options", "offload", "get_options")
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+
+def options(**kwargs: Any) -> Callable[[F], F]:
+    """|decorator|
+
+    Attaches options to a route, they can also be given as the third
+    element of the `endpoints_list` tuples which takes precedence.
+
+    Supported options:
+    ----------
+    offload: `bool`
+        The route is a regular function called as `func(data)` with the request
+        data inside the shard's executor instead of on the event loop.
+    offload_encode: `bool`
+        The response is serialized inside an executor.
+    cache: `float`
+        Successful responses are cached for this many seconds by the cluster
+        (and by the shard when it has a `cache_size`), per request data.
+    coalesce: `bool`
+        Identical requests received while one is running wait for it and share
+        its response instead of calling the route again (the default is `True`
+        for cached routes, `False` otherwise since routes may have side effects).
+    """
+    def decorator(func: F) -> F:
+        current = dict(getattr(func, "__cluster_options__", {}))
+        current.update(kwargs)
+        func.__cluster_options__ = current
+        return func
+    return decorator
+
+
+def offload(func: F) -> F:
+    """|decorator|
+
+    Shortcut for `@options(offload=True)`, keep in mind that with a
+    `ProcessPoolExecutor` the function must be defined at module level.
+    """
+    return options(offload=True)(func)
+
+
+def get_options(route: Sequence[Any]) -> Dict[str, Any]:
+    """Returns the options of an `endpoints_list` entry."""
+    current = dict(getattr(route[1], "__cluster_options__", {}))
+    if len(route) > 2 and route[2]:
+        current.update(route[2])
+    return current
@@ -0,0 +1,1365 @@
+"""
+The cluster: the websocket server shards and clients connect to.
+
+It keeps track of the connected shards and routes every client request to the
+shard it is meant for, run it with::
+
+    python -m discord.ext.cluster.server --port 9999 --secret-key my_secret_key
+
+or from code with :class:`ClusterServer`.
+
+Several clusters can share the load, each one announces the shards connected to
+it to its peers and forwards the requests meant for a shard it does not hold to
+the peer holding it. On one machine they can even share a port::
+
+    better-cluster --port 9999 --reuse-port --peer-port 10001 --peers ws://127.0.0.1:10002
+    better-cluster --port 9999 --reuse-port --peer-port 10002 --peers ws://127.0.0.1:10001
+"""
+
+from __future__ import annotations
+
+import os
+import stat
+import time
+import socket
+import asyncio
+import logging
+import argparse
+
+from contextlib import asynccontextmanager
+from uuid import uuid4
+from typing import List, Dict, Any, AsyncIterator, Awaitable, Callable, FrozenSet, Iterable, Optional, Sequence, Set, Tuple, Union
+
+from aiohttp import ClientError, ClientSession, ClientWebSocketResponse, WSMsgType
+from fastapi import FastAPI, Response, WebSocket, WebSocketDisconnect
+
+from .cache import ResponseCache, cache_key
+from .codec import JSON, Codec, from_subprotocol, negotiate, subprotocols
+from .metrics import CONTENT_TYPE, REGISTRY
+from .pool import client_session
+from .protocol import Body, pack, unpack
+from .pubsub import EventBuffer
+from .tracing import mark
+from .transport import split_unix_url
+
+__all__ = ("ClusterServer", "ShardsManager", "Registry", "PeerLink", "main")
+
+Reply = Callable[[Dict, Optional[Body]], Awaitable[None]]
+
+REQUEST_SECONDS = REGISTRY.histogram("cluster_router_request_seconds", "Time until the shards answered a request.", ("endpoint",))
+INFLIGHT = REGISTRY.gauge("cluster_router_inflight_requests", "Requests waiting for the shards.", ("endpoint",))
+SENT_BYTES = REGISTRY.counter("cluster_router_sent_bytes_total", "Bytes sent to the shards, the clients and the peers.")
+RECEIVED_BYTES = REGISTRY.counter("cluster_router_received_bytes_total", "Bytes received from the shards, the clients and the peers.")
+TIMEOUTS = REGISTRY.counter("cluster_router_timeouts_total", "Requests answered with code 504.", ("endpoint",))
+ERRORS = REGISTRY.counter("cluster_router_errors_total", "Requests answered with a 5xx code other than 504.", ("endpoint", "code"))
+CACHE_HITS = REGISTRY.counter("cluster_router_cache_hits_total", "Requests answered from the cache.", ("endpoint",))
+SHARDS = REGISTRY.gauge("cluster_router_connected_shards", "Shard connections, replicas included.")
+PUBLISHED = REGISTRY.counter("cluster_router_published_events_total", "Events published by the shards.")
+DROPPED = REGISTRY.counter("cluster_router_dropped_events_total", "Events dropped or coalesced because a subscriber fell behind.")
+
+
+async def send_message(websocket: WebSocket, header: Dict, body: Optional[Body] = None):
+    # binary frames only carry a routing header in front of the untouched body bytes
+    if (codec := websocket.state.codec) is not None:
+        frame = pack(header, body.encode(codec) if body is not None else b"")
+        await websocket.send_bytes(frame)
+        SENT_BYTES.inc(value=len(frame))
+        return
+
+    # text frames are the JSON messages understood by older clients and shards
+    message = dict(header)
+    if body is not None:
+        if not websocket.state.client:
+            message["data"] = body.decode()
+        elif "identifier" in header:
+            message["response"] = body.decode()
+        else:
+            message = {**(body.decode() or {}), **header}
+    text = JSON.dumps_text(message)
+    await websocket.send_text(text)
+    SENT_BYTES.inc(value=len(text))
+
+
+async def receive_message(websocket: WebSocket) -> Tuple[Dict, Body]:
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000))
+    RECEIVED_BYTES.inc(value=len(message["text"] if message.get("text") is not None else message.get("bytes") or b""))
+    if message.get("bytes") is not None and websocket.state.codec is not None:
+        header, raw = unpack(message["bytes"])
+        return header, Body(raw=raw, codec=websocket.state.codec)
+
+    data: Dict = JSON.loads(message["text"] if message.get("text") is not None else message["bytes"])
+    if not websocket.state.client:
+        return data, Body(data.pop("response", None))
+    request = data.pop("response", None)
+    if not isinstance(request, dict):
+        return data, Body(None)
+    kwargs = request.pop("kwargs", {})
+    return {**data, **request}, Body(kwargs)
+
+
+class Broadcast:
+    """Scatter-gather over the shards of a bot.
+
+    Every shard gets its own future, the broadcast completes as soon as the last
+    one is resolved or when the deadline passes, whichever comes first.
+    Each shard ends up with a status: `ok`, `failed`, `disconnected` or `timeout`.
+    """
+
+    def __init__(self, identifiers: Iterable[str], timeout: Optional[float] = None):
+        loop = asyncio.get_running_loop()
+        self.timeout = timeout
+        self.futures: Dict[str, asyncio.Future] = {identifier: loop.create_future() for identifier in identifiers}
+
+    def resolve(self, identifier: str, response: Body):
+        future = self.futures.get(identifier)
+        if future is not None and not future.done():
+            future.set_result({"response": response, "status": "ok"})
+
+    def fail(self, identifier: str, status: str):
+        future = self.futures.get(identifier)
+        if future is not None and not future.done():
+            future.set_result({"status": status})
+
+    async def as_completed(self) -> AsyncIterator[Tuple[str, Dict]]:
+        loop = asyncio.get_running_loop()
+        deadline = None if self.timeout is None else loop.time() + self.timeout
+        pending = {future: identifier for identifier, future in self.futures.items()}
+        try:
+            while pending:
+                timeout = None if deadline is None else max(deadline - loop.time(), 0)
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    break
+                for future in done:
+                    yield pending.pop(future), future.result()
+            for future, identifier in list(pending.items()):
+                del pending[future]
+                yield identifier, {"status": "timeout"}
+        finally:
+            for future in pending:
+                future.cancel()
+
+    async def gather(self) -> Dict[str, Dict]:
+        results = {}
+        async for identifier, result in self.as_completed():
+            if "response" in result:
+                result["response"] = result["response"].decode()
+            results[identifier] = result
+        return results
+
+
+class Waiter:
+    """A client waiting for a shard's response, expired once its deadline passes.
+
+    Clients sending the same request while it is in flight are added as followers
+    and get the same response.
+    """
+
+    __slots__ = ("client", "request_id", "shard", "timer", "cache", "key", "deadline", "followers", "retry", "endpoint", "started")
+
+    def __init__(
+        self, client: WebSocket, request_id: Optional[str], shard: WebSocket, deadline: Optional[float] = None, endpoint: str = ""
+    ):
+        self.client = client
+        self.request_id = request_id
+        self.shard = shard
+        self.deadline = deadline
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.timer: Optional[asyncio.TimerHandle] = None
+        # (key, ttl, version) when the response should be cached
+        self.cache: Optional[Tuple[Tuple, float, int]] = None
+        self.key: Optional[Tuple] = None
+        self.followers: List[Tuple[WebSocket, Optional[str]]] = []
+        # (bot_id, identifier, header, body) to send the request again to another replica of the shard
+        self.retry: Optional[Tuple[str, str, Dict, Body]] = None
+
+    def clients(self) -> List[Tuple[WebSocket, Optional[str]]]:
+        return [(self.client, self.request_id), *self.followers]
+
+
+class Subscriber:
+    """A client subscribed to topics of a bot, the events published to them wait in a
+    bounded buffer until they are sent so a slow client never holds the others back.
+    """
+
+    __slots__ = ("client", "request_id", "bot_id", "topics", "buffer", "task")
+
+    def __init__(self, client: WebSocket, request_id: Optional[str], bot_id: str, topics: FrozenSet[str], buffer: EventBuffer):
+        self.client = client
+        self.request_id = request_id
+        self.bot_id = bot_id
+        self.topics = topics
+        self.buffer = buffer
+        self.task = asyncio.create_task(self.run())
+
+    def push(self, header: Dict, body: Body):
+        dropped = self.buffer.dropped
+        self.buffer.put_nowait((header, body))
+        if self.buffer.dropped != dropped:
+            DROPPED.inc()
+
+    async def run(self):
+        while True:
+            header, body = await self.buffer.get()
+            try:
+                await send_message(self.client, {**header, "request_id": self.request_id}, body)
+            except (RuntimeError, WebSocketDisconnect):
+                return
+
+
+class Registry:
+    """|class|
+
+    The endpoints and route options announced by every shard, kept in memory and saved
+    to a JSON file so a shard reconnecting after a restart of the cluster is known again.
+    Writes are batched and done in a thread, they never block the event loop.
+
+    Parameters:
+    ----------
+    path: `str`
+        Where the registry is saved, `None` keeps it in memory only (the default is `db/registry.json`).
+    flush_delay: `float`
+        Seconds the changes are gathered before being written (the default is `1`).
+    """
+
+    def __init__(self, path: Optional[str] = "db/registry.json", flush_delay: float = 1.0):
+        self.path = path
+        self.flush_delay = flush_delay
+        self.entries: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self.dirty: bool = False
+        self.task: Optional[asyncio.Task] = None
+        self.logger = logging.getLogger("discord.ext.cluster")
+        if path is not None and os.path.isfile(path):
+            with open(path, "rb") as f:
+                self.entries = JSON.loads(f.read())
+
+    def get(self, bot_id: str, identifier: str) -> Optional[Dict[str, Any]]:
+        return self.entries.get(bot_id, {}).get(identifier)
+
+    def set(self, bot_id: str, identifier: str, entry: Dict[str, Any]):
+        self.entries.setdefault(bot_id, {})[identifier] = entry
+        self.save()
+
+    def merge(self, entries: Dict[str, Dict[str, Dict[str, Any]]]):
+        """Adds the entries known by a peer, so a shard can reconnect to any cluster of the deployment."""
+        changed = False
+        for bot_id, shards in entries.items():
+            for identifier, entry in shards.items():
+                if self.get(bot_id, identifier) != entry:
+                    self.entries.setdefault(bot_id, {})[identifier] = entry
+                    changed = True
+        if changed:
+            self.save()
+
+    def remove(self, bot_id: str, identifier: str):
+        if self.entries.get(bot_id, {}).pop(identifier, None) is not None:
+            if not self.entries[bot_id]:
+                del self.entries[bot_id]
+            self.save()
+
+    def save(self):
+        if self.path is None:
+            return
+        self.dirty = True
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.flush_later())
+
+    async def flush_later(self):
+        while self.dirty:
+            await asyncio.sleep(self.flush_delay)
+            await self.flush()
+
+    async def flush(self):
+        if self.path is None or not self.dirty:
+            return
+        self.dirty = False
+        # the snapshot is taken on the loop, only the file system work goes to a thread
+        data = JSON.dumps(self.entries)
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self.write, data)
+        except OSError as exception:
+            self.logger.error(f"Failed to save the registry to {self.path!r}", exc_info=exception)
+
+    def write(self, data: bytes):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # several clusters of the same machine may share the file
+        temporary = f"{self.path}.{os.getpid()}.tmp"
+        with open(temporary, "wb") as f:
+            f.write(data)
+        os.replace(temporary, self.path)
+
+
+class PeerLink:
+    """|class|
+
+    The connection to another cluster of the deployment. It carries the shards this
+    cluster announces and the requests it forwards, their answers come back on it.
+
+    Parameters:
+    ----------
+    manager: :class:`ShardsManager`
+        The manager of this cluster.
+    url: `str`
+        The url of the peer.
+    node: `str`
+        The url this cluster is reachable at, it is how the peer knows it.
+    secret_key: `str`
+        The key of the peer.
+    """
+
+    def __init__(self, manager: ShardsManager, url: str, node: str, secret_key: Optional[str] = None):
+        self.manager = manager
+        self.url = url
+        self.node = node
+        self.secret_key = secret_key
+        self.session: Optional[ClientSession] = None
+        self.ws: Optional[ClientWebSocketResponse] = None
+        self.codec: Codec = JSON
+        self.task: Optional[asyncio.Task] = None
+        self.logger = logging.getLogger("discord.ext.cluster")
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__} url={self.url!r} connected={self.connected}>"
+
+    @property
+    def connected(self) -> bool:
+        return self.ws is not None and not self.ws.closed
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    async def run(self):
+        while True:
+            try:
+                if self.session is None or self.session.closed:
+                    self.session = client_session(self.url)
+                self.ws = await self.session.ws_connect(
+                    split_unix_url(self.url)[0],
+                    autoclose=False,
+                    protocols=subprotocols(),
+                    headers={"Endpoints": "peer", "Secret-Key": str(self.secret_key), "Bot-ID": "peer", "Identifier": self.node},
+                )
+                self.codec = from_subprotocol(self.ws.protocol) or JSON
+                self.logger.info(f"Connected to the peer {self.url!r}")
+                await self.sync()
+                async for message in self.ws:
+                    if message.type is not WSMsgType.BINARY:
+                        continue
+                    header, raw = unpack(message.data)
+                    await self.manager.peer_reply(header, Body(raw=raw, codec=self.codec))
+            except (ClientError, OSError) as exception:
+                self.logger.warning(f"Failed to reach the peer {self.url!r}: {exception}")
+            finally:
+                self.ws = None
+                self.manager.fail_forwards(self)
+            await asyncio.sleep(3)
+
+    async def send(self, header: Dict, body: Optional[Body] = None):
+        if not self.connected:
+            raise ConnectionError(f"The peer {self.url!r} is not connected")
+        try:
+            await self.ws.send_bytes(pack(header, body.encode(self.codec) if body is not None else b""))
+        except RuntimeError as exception:
+            # a link closing under the send, the callers handle it like a link that is down
+            raise ConnectionError(f"The peer {self.url!r} is not connected") from exception
+
+    async def sync(self):
+        """Announces the shards connected to this cluster."""
+        try:
+            await self.send({"endpoint_choosen": "peer_sync"}, Body(self.manager.snapshot()))
+        except (ConnectionError, ClientError) as exception:
+            self.logger.warning(f"Failed to announce the shards to {self.url!r}: {exception}")
+
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
+        if self.ws is not None:
+            await self.ws.close()
+        if self.session is not None:
+            await self.session.close()
+
+
+class ShardsManager:
+    """|class|
+
+    Routes the requests of the clients to the connected shards and their responses back.
+
+    Parameters:
+    ----------
+    broadcast_timeout: `float`
+        Seconds a request to every shard waits for their answers when the client gave no deadline (the default is `30`).
+    cache_size: `int`
+        The number of responses the cache keeps (the default is `1024`).
+    registry: :class:`Registry`
+        Where the endpoints of the shards are kept (the default is an in-memory registry).
+    """
+
+    def __init__(self, broadcast_timeout: Optional[float] = 30.0, cache_size: int = 1024, registry: Optional[Registry] = None):
+        self.shards: Dict[str, Dict[str, Tuple[WebSocket, FrozenSet[str]]]] = {}
+        # the connections of the shards started with `replica=True`, the first one is also in `shards`
+        self.replicas: Dict[Tuple[str, str], List[WebSocket]] = {}
+        self.outstanding: Dict[WebSocket, int] = {}
+        # every endpoint of a bot, so requests are checked without going through its shards
+        self.endpoints: Dict[str, Set[str]] = {}
+        self.registry = registry if registry is not None else Registry(None)
+        # the peers of this cluster and the shards connected to them
+        self.links: Dict[str, PeerLink] = {}
+        self.remote_entries: Dict[str, Dict[str, Dict[str, Dict[str, Any]]]] = {}
+        self.remote: Dict[str, Dict[str, str]] = {}
+        self.forwards: Dict[str, Tuple[PeerLink, Reply]] = {}
+        self.forwarded: Dict[Tuple[WebSocket, str], str] = {}
+        self.waiters: Dict[str, Waiter] = {}
+        self.requests: Dict[Tuple[WebSocket, str], str] = {}
+        self.waiters_all_shards: Dict[str, Tuple[str, str, Optional[Broadcast], WebSocket]] = {}
+        self.broadcasts: Dict[Tuple[WebSocket, str], asyncio.Task] = {}
+        self.shard_maps: Dict[str, Dict[str, Any]] = {}
+        self.cache_rules: Dict[Tuple[str, str], Dict[str, float]] = {}
+        self.coalesce_rules: Dict[Tuple[str, str], FrozenSet[str]] = {}
+        self.flights: Dict[Tuple, str] = {}
+        # the clients subscribed to the topics of each bot
+        self.subscribers: Dict[Tuple[WebSocket, Optional[str]], Subscriber] = {}
+        self.topics: Dict[Tuple[str, str], Dict[Tuple[WebSocket, Optional[str]], Subscriber]] = {}
+        self.cache = ResponseCache(cache_size)
+        self.broadcast_timeout = broadcast_timeout
+
+    @staticmethod
+    async def send_response(
+        websocket: WebSocket, response: Union[Dict, Body], request_id: Optional[str] = None, extra: Optional[Dict] = None
+    ):
+        header = {} if request_id is None else {"request_id": request_id}
+        if extra:
+            header.update(extra)
+        if isinstance(response, Body):
+            await send_message(websocket, header, response)
+        else:
+            await send_message(websocket, {**response, **header})
+
+    def index_endpoints(self, bot_id: str):
+        if not self.shards.get(bot_id):
+            self.shards.pop(bot_id, None)
+            self.endpoints.pop(bot_id, None)
+            return
+        self.endpoints[bot_id] = set().union(*(shard[1] for shard in self.shards[bot_id].values()))
+
+    async def initialize_shard(self, websocket: WebSocket, header: Dict, body: Body):
+        bot_id = websocket.headers["Bot-ID"]
+        identifier = websocket.headers["Identifier"]
+        data_response = body.decode() or {}
+        replica = bool(data_response.get('replica'))
+        if bot_id in self.shards and identifier in self.shards.get(bot_id):
+            if not replica or (bot_id, identifier) not in self.replicas:
+                await send_message(websocket, {"message": f"Shard with ID {identifier!r} already exists!", "code": 500})
+                await websocket.close()
+                return 500
+            # another process of the same shard, the requests are spread between them
+            self.replicas[(bot_id, identifier)].append(websocket)
+            await send_message(websocket, {"message": "Successfuly connected to the cluster!", "code": 200})
+            return 200
+        if data_response.get('endpoints'):
+            entry = {
+                "endpoints": data_response.get('endpoints'),
+                "cache": data_response.get('cache', {}),
+                "coalesce": data_response.get('coalesce', []),
+            }
+            self.registry.set(bot_id, identifier, entry)
+        elif (entry := self.registry.get(bot_id, identifier)) is None:
+            # a shard reconnecting without its endpoints must have announced them before
+            await send_message(websocket, {"message": f"Shard with ID {identifier!r} has no known endpoints!", "code": 404})
+            await websocket.close()
+            return 404
+        self.shards.setdefault(bot_id, {})[identifier] = (websocket, frozenset(entry['endpoints']))
+        if replica:
+            self.replicas[(bot_id, identifier)] = [websocket]
+        self.cache_rules[(bot_id, identifier)] = entry.get('cache', {})
+        self.coalesce_rules[(bot_id, identifier)] = frozenset(entry.get('coalesce', []))
+        self.index_endpoints(bot_id)
+        self.announce()
+        await send_message(websocket, {"message": "Successfuly connected to the cluster!", "code": 200})
+        return 200
+
+    async def disconnect_shard(self, websocket: WebSocket, header: Dict, body: Body):
+        bot_id = websocket.headers["Bot-ID"]
+        identifier = websocket.headers["Identifier"]
+        if bot_id in self.shards and identifier in self.shards[bot_id]:
+            if websocket in self.connections(bot_id, identifier):
+                await websocket.close()
+                if await self.drop_shard(bot_id, identifier, websocket):
+                    self.registry.remove(bot_id, identifier)
+                return 200
+            else:
+                await websocket.close()
+                return 500
+        await websocket.close()
+        return 500
+
+    async def disconnect(self, websocket: WebSocket):
+        for key in [key for key in self.broadcasts if key[0] is websocket]:
+            self.broadcasts.pop(key).cancel()
+        for key in [key for key in self.requests if key[0] is websocket]:
+            if (detached := self.detach(*key)) is not None:
+                asyncio.create_task(self.cancel_on_shard(detached[1].shard, detached[0]))
+        for key in [key for key in self.forwarded if key[0] is websocket]:
+            asyncio.create_task(self.cancel_forward(self.forwarded.pop(key)))
+        for key in [key for key in self.subscribers if key[0] is websocket]:
+            self.unsubscribe(*key)
+        if websocket.state.peer:
+            self.forget_node(str(websocket.headers["Identifier"]))
+            return
+
+        bot_id = str(websocket.headers["Bot-ID"])
+        identifier = str(websocket.headers["Identifier"])
+        if bot_id in self.shards and identifier in self.shards[bot_id]:
+            if websocket in self.connections(bot_id, identifier):
+                await self.drop_shard(bot_id, identifier, websocket)
+
+    def connections(self, bot_id: str, identifier: str) -> List[WebSocket]:
+        if (replicas := self.replicas.get((bot_id, identifier))) is not None:
+            return replicas
+        shard = self.shards.get(bot_id, {}).get(identifier)
+        return [] if shard is None else [shard[0]]
+
+    async def drop_shard(self, bot_id: str, identifier: str, websocket: WebSocket) -> bool:
+        """Forgets a connection of a shard, returns whether it was its last replica."""
+        replicas = self.replicas.get((bot_id, identifier), [])
+        if websocket in replicas:
+            replicas.remove(websocket)
+        self.fail_broadcasts(websocket)
+        if replicas:
+            # the requests it was working on go to the remaining replicas
+            self.shards[bot_id][identifier] = (replicas[0], self.shards[bot_id][identifier][1])
+            await self.fail_waiters(websocket)
+            return False
+        self.replicas.pop((bot_id, identifier), None)
+        del self.shards[bot_id][identifier]
+        self.index_endpoints(bot_id)
+        self.announce()
+        self.forget_shard_map(bot_id, identifier)
+        self.cache.invalidate(bot_id, identifier)
+        await self.fail_waiters(websocket)
+        return True
+
+    def choose(self, bot_id: str, identifier: str) -> WebSocket:
+        """The replica of a shard with the fewest requests in flight."""
+        if replicas := self.replicas.get((bot_id, identifier)):
+            return min(replicas, key=lambda replica: self.outstanding.get(replica, 0))
+        return self.shards[bot_id][identifier][0]
+
+    def assign(self, waiter: Waiter, shard: WebSocket):
+        waiter.shard = shard
+        self.outstanding[shard] = self.outstanding.get(shard, 0) + 1
+
+    def settle(self, shard: WebSocket):
+        if (count := self.outstanding.get(shard, 0)) > 1:
+            self.outstanding[shard] = count - 1
+        else:
+            self.outstanding.pop(shard, None)
+
+    async def update_shard(self, websocket: WebSocket, header: Dict, body: Body):
+        bot_id = websocket.headers["Bot-ID"]
+        identifier = websocket.headers["Identifier"]
+        data = body.decode() or {}
+        shard_map = self.shard_maps.setdefault(bot_id, {"count": 1, "owners": {}})
+        shard_map["count"] = int(data.get("shard_count") or 1)
+        for shard_id in data.get("shard_ids", []):
+            shard_map["owners"][int(shard_id)] = identifier
+        self.announce()
+
+    def forget_shard_map(self, bot_id: str, identifier: str):
+        if (shard_map := self.shard_maps.get(bot_id)) is None:
+            return
+        shard_map["owners"] = {shard_id: owner for shard_id, owner in shard_map["owners"].items() if owner != identifier}
+        if not shard_map["owners"]:
+            del self.shard_maps[bot_id]
+
+    def resolve_guild(self, bot_id: str, guild_id: Union[str, int, None]) -> Optional[str]:
+        if guild_id is None:
+            return None
+        # https://discord.com/developers/docs/topics/gateway#sharding
+        if (shard_map := self.shard_maps.get(bot_id)) is not None:
+            if (owner := shard_map["owners"].get((int(guild_id) >> 22) % shard_map["count"])) is not None:
+                return owner
+        for entries in self.remote_entries.values():
+            for identifier, entry in entries.get(bot_id, {}).items():
+                if entry.get("shard_count") and (int(guild_id) >> 22) % entry["shard_count"] in entry.get("shard_ids", ()):
+                    return identifier
+        return None
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """The shards connected to this cluster and its registry, as announced to its peers."""
+        snapshot = {}
+        for bot_id, shards in self.shards.items():
+            shard_map = self.shard_maps.get(bot_id, {"count": None, "owners": {}})
+            for identifier in shards:
+                entry = dict(self.registry.get(bot_id, identifier) or {})
+                entry["shard_ids"] = [shard_id for shard_id, owner in shard_map["owners"].items() if owner == identifier]
+                entry["shard_count"] = shard_map["count"]
+                snapshot.setdefault(bot_id, {})[identifier] = entry
+        return {"shards": snapshot, "registry": self.registry.entries}
+
+    def announce(self):
+        for link in self.links.values():
+            if link.connected:
+                asyncio.create_task(link.sync())
+
+    def start_peers(self, node: str, peers: Sequence[str], secret_key: Optional[str] = None):
+        for url in peers:
+            if url != node and url not in self.links:
+                self.links[url] = link = PeerLink(self, url, node, secret_key)
+                link.start()
+
+    async def close_peers(self):
+        for link in self.links.values():
+            await link.close()
+        self.links.clear()
+
+    async def peer_sync(self, websocket: WebSocket, header: Dict, body: Body):
+        data = body.decode() or {}
+        self.remote_entries[str(websocket.headers["Identifier"])] = data.get("shards", {})
+        self.registry.merge(data.get("registry", {}))
+        self.index_remote()
+
+    def forget_node(self, node: str):
+        if self.remote_entries.pop(node, None) is not None:
+            self.index_remote()
+
+    def index_remote(self):
+        self.remote = {}
+        for node, entries in self.remote_entries.items():
+            for bot_id, shards in entries.items():
+                for identifier in shards:
+                    self.remote.setdefault(bot_id, {})[identifier] = node
+
+    def known_endpoints(self, bot_id: str) -> Set[str]:
+        endpoints = set(self.endpoints.get(bot_id, ()))
+        for entries in self.remote_entries.values():
+            for entry in entries.get(bot_id, {}).values():
+                endpoints.update(entry.get("endpoints", ()))
+        return endpoints
+
+    def locate(self, bot_id: str, identifier: str) -> Optional[PeerLink]:
+        """Returns the link to the peer holding a shard that is not connected to this cluster."""
+        if (node := self.remote.get(bot_id, {}).get(identifier)) is None:
+            return None
+        link = self.links.get(node)
+        return link if link is not None and link.connected else None
+
+    async def forward(self, link: PeerLink, header: Dict, body: Optional[Body], reply: Reply) -> str:
+        ID = str(uuid4())
+        self.forwards[ID] = (link, reply)
+        try:
+            await link.send({**header, "request_id": ID}, body)
+        except (ConnectionError, ClientError):
+            self.forwards.pop(ID, None)
+            await reply({"message": "The cluster holding the shard is unreachable!", "code": 503}, None)
+        return ID
+
+    async def peer_reply(self, header: Dict, body: Body):
+        ID = header.pop("request_id", None)
+        # chunks of a streamed response are followed by more frames for the same request
+        if "seq" in header:
+            forward = self.forwards.get(ID)
+        else:
+            forward = self.forwards.pop(ID, None)
+        if forward is not None:
+            await forward[1](header, body)
+
+    def fail_forwards(self, link: PeerLink):
+        for ID in [ID for ID, forward in self.forwards.items() if forward[0] is link]:
+            _, reply = self.forwards.pop(ID)
+            asyncio.create_task(reply({"message": "The cluster holding the shard disconnected before answering!", "code": 503}, None))
+
+    async def cancel_forward(self, ID: str):
+        if (forward := self.forwards.pop(ID, None)) is None:
+            return
+        try:
+            await forward[0].send({"endpoint_choosen": "cancel_request", "request_id": ID})
+        except (ConnectionError, ClientError):
+            pass
+
+    async def relay(self, websocket: WebSocket, header: Dict, body: Body, bot_id: str, identifier: str, link: PeerLink):
+        request_id: Optional[str] = header.get("request_id")
+
+        async def reply(response: Dict, response_body: Optional[Body]):
+            if "seq" not in response and request_id is not None:
+                self.forwarded.pop((websocket, request_id), None)
+            if request_id is not None:
+                response["request_id"] = request_id
+            try:
+                await send_message(websocket, response, response_body)
+            except (RuntimeError, WebSocketDisconnect):
+                pass
+
+        forward_header = {key: value for key, value in header.items() if key != "endpoint_choosen"}
+        forward_header.update({"endpoint_choosen": "create_request", "bot_id": bot_id, "identifier": identifier})
+        ID = await self.forward(link, forward_header, body, reply)
+        if request_id is not None and ID in self.forwards:
+            self.forwarded[(websocket, request_id)] = ID
+
+    async def subscribe(self, websocket: WebSocket, header: Dict, body: Body):
+        request_id: Optional[str] = header.get("request_id")
+        topics = header.get("topics")
+        if not topics or not isinstance(topics, list):
+            await self.send_response(websocket, {"message": "No topics to subscribe to!", "code": 400}, request_id)
+            return 400
+        try:
+            buffer = EventBuffer(int(header.get("buffer", 100)), str(header.get("policy", "drop_oldest")), lambda event: event[0]["topic"])
+        except (TypeError, ValueError) as exception:
+            await self.send_response(websocket, {"message": str(exception), "code": 400}, request_id)
+            return 400
+
+        self.unsubscribe(websocket, request_id)
+        bot_id = str(websocket.headers["Bot-ID"])
+        key = (websocket, request_id)
+        subscriber = self.subscribers[key] = Subscriber(websocket, request_id, bot_id, frozenset(map(str, topics)), buffer)
+        for topic in subscriber.topics:
+            self.topics.setdefault((bot_id, topic), {})[key] = subscriber
+        return 200
+
+    def unsubscribe(self, websocket: WebSocket, request_id: Optional[str]):
+        if (subscriber := self.subscribers.pop((websocket, request_id), None)) is None:
+            return
+        subscriber.task.cancel()
+        for topic in subscriber.topics:
+            subscribers = self.topics[(subscriber.bot_id, topic)]
+            subscribers.pop((websocket, request_id), None)
+            if not subscribers:
+                del self.topics[(subscriber.bot_id, topic)]
+
+    async def publish(self, websocket: WebSocket, header: Dict, body: Body):
+        topic = str(header.get("topic"))
+        if websocket.state.peer:
+            bot_id, identifier = str(header.get("bot_id")), header.get("identifier")
+        else:
+            bot_id, identifier = str(websocket.headers["Bot-ID"]), str(websocket.headers["Identifier"])
+            PUBLISHED.inc()
+            # the clients subscribed through a peer get the event from it
+            for link in self.links.values():
+                if link.connected:
+                    try:
+                        await link.send({"endpoint_choosen": "publish", "bot_id": bot_id, "identifier": identifier, "topic": topic}, body)
+                    except (ConnectionError, ClientError):
+                        pass
+        event = {"identifier": identifier, "topic": topic}
+        for subscriber in self.topics.get((bot_id, topic), {}).values():
+            subscriber.push(event, body)
+
+    async def invalidate_cache(self, websocket: WebSocket, header: Dict, body: Body):
+        scope = (websocket.headers["Bot-ID"], websocket.headers["Identifier"])
+        if (endpoint := header.get("endpoint")) is not None:
+            scope += (endpoint,)
+        self.cache.invalidate(*scope, data=body.decode() if endpoint is not None else None)
+
+    def fail_broadcasts(self, shard: WebSocket):
+        for ID, (_, identifier, broadcast, shard_websocket) in list(self.waiters_all_shards.items()):
+            if shard_websocket is shard:
+                del self.waiters_all_shards[ID]
+                if broadcast is not None:
+                    broadcast.fail(identifier, "disconnected")
+
+    async def fail_waiters(self, shard: WebSocket):
+        for ID in [ID for ID, waiter in self.waiters.items() if waiter.shard is shard]:
+            # the awaits below let other waiters of the list expire, be cancelled or be answered
+            if (waiter := self.waiters.get(ID)) is None or waiter.shard is not shard:
+                continue
+            if waiter.retry is not None and self.replicas.get(waiter.retry[:2]):
+                # failover, another replica of the shard answers in place of this one
+                bot_id, identifier, shard_header, body = waiter.retry
+                self.settle(shard)
+                self.assign(waiter, self.choose(bot_id, identifier))
+                try:
+                    await send_message(waiter.shard, shard_header, body)
+                    continue
+                except (RuntimeError, WebSocketDisconnect):
+                    pass
+            if (waiter := self.pop_waiter(ID)) is None:
+                continue
+            ERRORS.inc(waiter.endpoint, "503")
+            await self.notify(waiter, {"message": "The shard disconnected before answering!", "code": 503})
+
+    def pop_waiter(self, ID: str) -> Optional[Waiter]:
+        if (waiter := self.waiters.pop(ID, None)) is None:
+            return None
+        if waiter.timer is not None:
+            waiter.timer.cancel()
+        self.settle(waiter.shard)
+        INFLIGHT.dec(waiter.endpoint)
+        REQUEST_SECONDS.observe(time.perf_counter() - waiter.started, waiter.endpoint)
+        if waiter.key is not None and self.flights.get(waiter.key) == ID:
+            del self.flights[waiter.key]
+        for client, request_id in waiter.clients():
+            if request_id is not None:
+                self.requests.pop((client, request_id), None)
+        return waiter
+
+    def join(self, key: Tuple, websocket: WebSocket, request_id: Optional[str], deadline: Optional[float]) -> bool:
+        if (ID := self.flights.get(key)) is None or (waiter := self.waiters.get(ID)) is None:
+            return False
+        # a follower cannot be answered later than its own deadline
+        if deadline is not None and (waiter.deadline is None or waiter.deadline > deadline):
+            return False
+        waiter.followers.append((websocket, request_id))
+        if request_id is not None:
+            self.requests[(websocket, request_id)] = ID
+        return True
+
+    def detach(self, websocket: WebSocket, request_id: Optional[str]) -> Optional[Tuple[str, Waiter]]:
+        """Removes a client from its request, the request is returned once nobody waits for it anymore."""
+        if (ID := self.requests.pop((websocket, request_id), None)) is None or (waiter := self.waiters.get(ID)) is None:
+            return None
+        if (websocket, request_id) in waiter.followers:
+            waiter.followers.remove((websocket, request_id))
+            return None
+        if waiter.followers:
+            waiter.client, waiter.request_id = waiter.followers.pop(0)
+            return None
+        return ID, self.pop_waiter(ID)
+
+    async def notify(self, waiter: Waiter, response: Union[Dict, Body], extra: Optional[Dict] = None):
+        for client, request_id in waiter.clients():
+            try:
+                await self.send_response(client, response, request_id, extra)
+            except (RuntimeError, WebSocketDisconnect):
+                pass
+
+    async def cancel_on_shard(self, shard: WebSocket, ID: str):
+        try:
+            await send_message(shard, {"endpoint_choosen": "cancel_request", "uuid": ID})
+        except (RuntimeError, WebSocketDisconnect):
+            pass
+
+    async def expire(self, ID: str):
+        if (waiter := self.pop_waiter(ID)) is None:
+            return
+        TIMEOUTS.inc(waiter.endpoint)
+        await self.notify(waiter, {"message": "The request timed out!", "code": 504})
+        await self.cancel_on_shard(waiter.shard, ID)
+
+    async def return_response(self, websocket: WebSocket, header: Dict, body: Body):
+        if (waiter_all := self.waiters_all_shards.pop(header.get("uuid"), None)) is not None:
+            _, identifier, broadcast, _ = waiter_all
+            if broadcast is not None:
+                broadcast.resolve(identifier, body)
+            return
+        if (seq := header.get("seq")) is not None:
+            # a chunk of a streamed response, the request goes on until the last frame
+            if (waiter := self.waiters.get(header.get("uuid"))) is not None:
+                await self.notify(waiter, body, {"identifier": header.get("identifier"), "seq": seq})
+            return
+        if (waiter := self.pop_waiter(header.get("uuid"))) is None:
+            return
+        if (code := int(header.get("code", 200))) == 504:
+            TIMEOUTS.inc(waiter.endpoint)
+        elif code >= 500:
+            ERRORS.inc(waiter.endpoint, str(code))
+        if waiter.cache is not None and header.get("code") == 200:
+            key, ttl, version = waiter.cache
+            self.cache.set(key, body, ttl, version)
+        extra = {}
+        if "shm" in header:
+            # a body left in shared memory by the shard is only described by the header
+            extra["shm"] = header["shm"]
+        if (trace := header.get("trace")) is not None:
+            mark(trace, "cluster", "returned")
+            extra["trace"] = trace
+        await self.notify(waiter, body, extra)
+
+    async def create_request(self, websocket: WebSocket, header: Dict, body: Body):
+        request_id: Optional[str] = header.get("request_id")
+        if (trace := header.get("trace")) is not None:
+            mark(trace, "cluster", "received")
+        if websocket.state.peer:
+            # requests forwarded by a peer name the shard they are meant for
+            bot_id, identifier = str(header.get("bot_id")), str(header.get("identifier"))
+        else:
+            if not (identifier := websocket.headers["Identifier"]):
+                await send_message(websocket, {"message": "Missing shard ID!", "code": 500})
+                await websocket.close()
+                return 500
+            if not (bot_id := websocket.headers["Bot-ID"]):
+                await send_message(websocket, {"message": "Missing bot ID!", "code": 500})
+                await websocket.close()
+                return 500
+        if bot_id not in self.shards and bot_id not in self.remote:
+            await self.send_response(websocket, {"message": f"Bot with ID {bot_id!r} doesn't exists!", "code": 404}, request_id)
+            return 404
+        if identifier == "guild" and (identifier := self.resolve_guild(bot_id, header.get("guild_id"))) is None:
+            await self.send_response(websocket, {"message": f"No shard handles the guild {header.get('guild_id')!r}!", "code": 404}, request_id)
+            return 404
+        if identifier not in self.shards.get(bot_id, {}) and not websocket.state.peer:
+            if (link := self.locate(bot_id, identifier)) is not None:
+                await self.relay(websocket, header, body, bot_id, identifier, link)
+                return 200
+        if identifier not in self.shards.get(bot_id, {}):
+            await self.send_response(websocket, {"message": f"Shard with ID {identifier!r} doesn't exists!", "code": 404}, request_id)
+            return 404
+
+        endpoints = self.shards[bot_id][identifier][1]
+
+        endpoint: Optional[str] = header.get("endpoint")
+        deadline: Optional[float] = header.get("deadline")
+        # a batch carries several calls in its body, the shard answers unknown endpoints per call
+        batch: bool = bool(header.get("batch"))
+        window: Optional[int] = header.get("stream_window")
+
+        if not batch and not endpoint in endpoints:
+            await self.send_response(websocket, {"message": f"Unknown endpoint!", "code": 404}, request_id)
+            return 404
+        if deadline is not None and deadline <= time.time():
+            TIMEOUTS.inc("batch" if batch else endpoint)
+            await self.send_response(websocket, {"message": "The request timed out!", "code": 504}, request_id)
+            return 504
+
+        # streamed responses are never cached nor shared
+        ttl = None if window else self.cache_rules.get((bot_id, identifier), {}).get(endpoint)
+        coalesce = not window and endpoint in self.coalesce_rules.get((bot_id, identifier), ())
+        key = cache_key(bot_id, identifier, endpoint, data=body.decode()) if ttl or coalesce else None
+        if ttl and (cached := self.cache.get(key)) is not None:
+            CACHE_HITS.inc(endpoint)
+            if trace is not None:
+                mark(trace, "cluster", "returned")
+            await self.send_response(websocket, cached, request_id, {"trace": trace} if trace is not None else None)
+            return 200
+        if coalesce and self.join(key, websocket, request_id, deadline):
+            return 200
+
+        ID = str(uuid4())
+        shard_websocket = self.choose(bot_id, identifier)
+        waiter = self.waiters[ID] = Waiter(websocket, request_id, shard_websocket, deadline, "batch" if batch else endpoint)
+        self.assign(waiter, shard_websocket)
+        INFLIGHT.inc(waiter.endpoint)
+        if ttl:
+            waiter.cache = (key, ttl, self.cache.version)
+        if coalesce:
+            waiter.key = key
+            self.flights[key] = ID
+        if request_id is not None:
+            self.requests[(websocket, request_id)] = ID
+        shard_header = {"endpoint": endpoint, "uuid": ID, "identifier": identifier}
+        if batch:
+            shard_header["batch"] = True
+        if window:
+            shard_header["window"] = window
+        if key is None and (threshold := header.get("shm")) is not None:
+            # a segment can only be read once, so responses shared between clients never use it
+            shard_header["shm"] = threshold
+        if deadline is not None:
+            shard_header["deadline"] = deadline
+            waiter.timer = asyncio.get_running_loop().call_later(
+                deadline - time.time(), lambda: asyncio.create_task(self.expire(ID))
+            )
+        if trace is not None:
+            mark(trace, "cluster", "dispatched")
+            shard_header["trace"] = trace
+        if not window and (bot_id, identifier) in self.replicas:
+            # a stream cannot start over, the other requests can
+            waiter.retry = (bot_id, identifier, shard_header, body)
+        try:
+            await send_message(waiter.shard, shard_header, body)
+        except (RuntimeError, WebSocketDisconnect):
+            # the shard is gone but was not unregistered yet, its requests fail over
+            # to another replica or are answered with a 503, the client's connection stays up
+            if (shard_websocket := waiter.shard) in self.connections(bot_id, identifier):
+                await self.drop_shard(bot_id, identifier, shard_websocket)
+            else:
+                await self.fail_waiters(shard_websocket)
+            return 200 if ID in self.waiters else 503
+        return 200
+
+    async def create_request_all_shard(self, websocket: WebSocket, header: Dict, body: Body):
+        request_id: Optional[str] = header.get("request_id")
+        if not (bot_id := str(websocket.headers["Bot-ID"])):
+            await send_message(websocket, {"message": "Missing bot ID!", "code": 500})
+            await websocket.close()
+            return 500
+        if bot_id not in self.shards and bot_id not in self.remote:
+            await self.send_response(websocket, {"message": f"Bot with ID {bot_id!r} doesn't exists!", "code": 404}, request_id)
+            return 404
+
+        endpoint: Optional[str] = header.get("endpoint")
+        wait_finish: Optional[bool] = header.get("wait_finish", True)
+        deadline: Optional[float] = header.get("deadline")
+        timeout: Optional[float] = header.get("timeout", self.broadcast_timeout)
+        if deadline is not None:
+            timeout = max(deadline - time.time(), 0)
+
+        if endpoint not in self.endpoints.get(bot_id, ()) and endpoint not in self.known_endpoints(bot_id):
+            await self.send_response(websocket, {"message": f"Unknown endpoint!", "code": 404}, request_id)
+            return 404
+
+        # only measured once the endpoint is known, every unknown name would add a series to the metrics
+        started = time.perf_counter()
+        INFLIGHT.inc(endpoint)
+
+        def measure(_: asyncio.Task):
+            INFLIGHT.dec(endpoint)
+            REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint)
+
+        asyncio.current_task().add_done_callback(measure)
+
+        shards = dict(self.shards.get(bot_id, {}))
+        # the shards connected to the peers get the request through them
+        remote = {identifier: node for identifier, node in self.remote.get(bot_id, {}).items() if identifier not in shards}
+        broadcast = Broadcast([*shards, *remote], timeout) if wait_finish else None
+
+        async def shard_task(identifier: str, shard_websocket: WebSocket, ID: str):
+            shard_header = {"endpoint": endpoint, "identifier": identifier, "uuid": ID}
+            if deadline is not None:
+                shard_header["deadline"] = deadline
+            try:
+                await send_message(shard_websocket, shard_header, body)
+            except Exception:
+                self.waiters_all_shards.pop(ID, None)
+                if broadcast is not None:
+                    broadcast.fail(identifier, "failed")
+
+        IDs = []
+        for identifier in shards:
+            ID = str(uuid4())
+            shard_websocket = self.choose(bot_id, identifier)
+            IDs.append((ID, shard_websocket))
+            self.waiters_all_shards[ID] = (bot_id, identifier, broadcast, shard_websocket)
+            asyncio.create_task(shard_task(identifier, shard_websocket, ID))
+
+        forward_IDs = []
+        forward_header = {"endpoint_choosen": "create_request", "endpoint": endpoint, "bot_id": bot_id}
+        if deadline is not None or timeout is not None:
+            forward_header["deadline"] = deadline if deadline is not None else time.time() + timeout
+        for identifier, node in remote.items():
+            if (link := self.links.get(node)) is None or not link.connected:
+                if broadcast is not None:
+                    broadcast.fail(identifier, "disconnected")
+                continue
+
+            async def reply(response: Dict, response_body: Optional[Body], identifier: str = identifier):
+                if broadcast is None:
+                    return
+                if response.get("code", 200) != 200 and not response_body:
+                    broadcast.fail(identifier, "timeout" if response.get("code") == 504 else "failed")
+                else:
+                    broadcast.resolve(identifier, response_body)
+
+            forward_IDs.append(await self.forward(link, {**forward_header, "identifier": identifier}, body, reply))
+
+        if broadcast is None:
+            await self.send_response(websocket, {"message": "The requests were sent.", "code": 200}, request_id)
+            return 200
+
+        try:
+            if header.get("stream"):
+                # every shard's answer is forwarded as soon as it arrives, without being decoded
+                limit: Optional[int] = header.get("limit")
+                answered = 0
+                completed = broadcast.as_completed()
+                try:
+                    async for identifier, result in completed:
+                        reply = {"identifier": identifier, "status": result["status"]}
+                        if request_id is not None:
+                            reply["request_id"] = request_id
+                        await send_message(websocket, reply, result.get("response"))
+                        answered += result["status"] == "ok"
+                        if limit is not None and answered >= limit:
+                            break
+                finally:
+                    await completed.aclose()
+                await self.send_response(websocket, {"message": "The requests have been made.", "done": True, "code": 200}, request_id)
+            else:
+                results = await broadcast.gather()
+                await self.send_response(websocket, {"message": "The requests have been made.", "data": results, "code": 200}, request_id)
+        finally:
+            # shards that did not answer in time or after a cancel stop working on it
+            for ID, shard_websocket in IDs:
+                if self.waiters_all_shards.pop(ID, None) is not None:
+                    asyncio.create_task(self.cancel_on_shard(shard_websocket, ID))
+            for ID in forward_IDs:
+                asyncio.create_task(self.cancel_forward(ID))
+        return 200
+
+    def start_broadcast(self, websocket: WebSocket, header: Dict, body: Body):
+        task = asyncio.create_task(self.create_request_all_shard(websocket=websocket, header=header, body=body))
+        if (request_id := header.get("request_id")) is not None:
+            key = (websocket, request_id)
+            self.broadcasts[key] = task
+            task.add_done_callback(lambda _: self.broadcasts.pop(key, None))
+
+    async def stream_credit(self, websocket: WebSocket, request_id: Optional[str], credit: int):
+        if (forward_ID := self.forwarded.get((websocket, request_id))) is not None and (forward := self.forwards.get(forward_ID)) is not None:
+            try:
+                await forward[0].send({"endpoint_choosen": "stream_credit", "request_id": forward_ID, "credit": credit})
+            except (ConnectionError, ClientError):
+                pass
+            return
+        if (ID := self.requests.get((websocket, request_id))) is None or (waiter := self.waiters.get(ID)) is None:
+            return
+        try:
+            await send_message(waiter.shard, {"endpoint_choosen": "stream_credit", "uuid": ID, "credit": credit})
+        except (RuntimeError, WebSocketDisconnect):
+            pass
+
+    async def cancel_request(self, websocket: WebSocket, request_id: Optional[str]):
+        if (task := self.broadcasts.pop((websocket, request_id), None)) is not None:
+            task.cancel()
+        if (forward_ID := self.forwarded.pop((websocket, request_id), None)) is not None:
+            await self.cancel_forward(forward_ID)
+        if (detached := self.detach(websocket, request_id)) is not None:
+            await self.cancel_on_shard(detached[1].shard, detached[0])
+        self.unsubscribe(websocket, request_id)
+
+
+class ClusterServer:
+    """|class|
+
+    The cluster, a FastAPI application routing the requests of the clients to the shards.
+
+        server = ClusterServer(secret_key="my_secret_key", port=9999)
+        server.run()
+
+    Parameters:
+    ----------
+    secret_key: `str`
+        The key shards and clients must present (the default is `None`).
+    host: `str`
+        The interface to listen on (the default is `0.0.0.0`).
+    port: `int`
+        The port to listen on (the default is `9999`).
+    unix_socket: `str`
+        Listen on this Unix socket instead of TCP, for shards and clients of the same machine.
+    registry_path: `str`
+        Where the endpoints of the shards are saved, `None` keeps them in memory only (the default is `db/registry.json`).
+    broadcast_timeout: `float`
+        Seconds a request to every shard waits for their answers when the client gave no deadline (the default is `30`).
+    cache_size: `int`
+        The number of responses the cache keeps (the default is `1024`).
+    uvloop: `bool`
+        Run on uvloop, `None` uses it when it is installed (the default is `None`).
+    peers: `list`
+        The urls of the other clusters of the deployment, shards and requests are shared with them.
+    advertise: `str`
+        The url the peers reach this cluster at, it must be listed as is in their `peers`
+        (the default is built from `host` and `peer_port`, or `port`).
+    peer_port: `int`
+        Also listen on this port, for clusters sharing `port` with `reuse_port` the peers need an address of their own.
+    reuse_port: `bool`
+        Bind `port` with `SO_REUSEPORT` so several clusters of the same machine share it (the default is `False`).
+    metrics: `bool`
+        Serve the latency, throughput and error metrics in the Prometheus format on `/metrics` (the default is `True`).
+    """
+
+    def __init__(
+        self,
+        secret_key: Optional[str] = None,
+        host: str = "0.0.0.0",
+        port: int = 9999,
+        unix_socket: Optional[str] = None,
+        registry_path: Optional[str] = "db/registry.json",
+        broadcast_timeout: Optional[float] = 30.0,
+        cache_size: int = 1024,
+        uvloop: Optional[bool] = None,
+        peers: Sequence[str] = (),
+        advertise: Optional[str] = None,
+        peer_port: Optional[int] = None,
+        reuse_port: bool = False,
+        metrics: bool = True,
+    ) -> None:
+        self.secret_key = secret_key
+        self.host = host
+        self.port = port
+        self.unix_socket = unix_socket
+        self.uvloop = uvloop
+        self.peers = list(peers)
+        self.peer_port = peer_port
+        self.reuse_port = reuse_port
+        self.advertise = advertise or self.default_advertise()
+        self.manager = ShardsManager(broadcast_timeout, cache_size, Registry(registry_path))
+
+        self.app = FastAPI(openapi_url=None, docs_url=None, redoc_url=None, lifespan=self.lifespan)
+        self.app.add_api_websocket_route("/", self.websocket_request_manager)
+        if metrics:
+            self.app.add_api_route("/metrics", self.metrics, methods=["GET"], include_in_schema=False)
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__} shards={sum(len(x) for x in self.manager.shards.values())}>"
+
+    def default_advertise(self) -> str:
+        if self.unix_socket is not None and self.peer_port is None:
+            return f"ws+unix://{self.unix_socket}"
+        host = "127.0.0.1" if self.host in ("0.0.0.0", "::", "") else self.host
+        return f"ws://{host}:{self.peer_port or self.port}"
+
+    @asynccontextmanager
+    async def lifespan(self, app: FastAPI) -> AsyncIterator[None]:
+        self.manager.start_peers(self.advertise, self.peers, self.secret_key)
+        try:
+            yield
+        finally:
+            await self.manager.close_peers()
+            await self.manager.registry.flush()
+
+    async def metrics(self) -> Response:
+        manager = self.manager
+        SHARDS.set(value=sum(len(manager.connections(bot_id, identifier)) for bot_id in manager.shards for identifier in manager.shards[bot_id]))
+        return Response(REGISTRY.render(), media_type=CONTENT_TYPE)
+
+    def is_secure(self, headers_secret_key: Union[str, int]) -> bool:
+        if key := headers_secret_key:
+            return str(key) == str(self.secret_key)
+        return bool(headers_secret_key is None)
+
+    async def websocket_request_manager(self, websocket: WebSocket):
+        shards_manager = self.manager
+        subprotocol = negotiate(websocket.scope.get("subprotocols", []))
+        websocket.state.codec = from_subprotocol(subprotocol)
+        websocket.state.client = "Endpoints" in websocket.headers
+        websocket.state.peer = websocket.headers.get("Endpoints") == "peer"
+        await websocket.accept(subprotocol=subprotocol)
+        if not self.is_secure(str(websocket.headers['Secret-Key'])):
+            await send_message(websocket, {"message": "Invalid secret key!", "code": 403})
+            return await websocket.close()
+        if not websocket.headers["Bot-ID"]:
+            await send_message(websocket, {"message": "Missing bot ID!", "code": 500})
+            return await websocket.close()
+        if not websocket.headers["identifier"]:
+            await send_message(websocket, {"message": "Missing identifier!", "code": 500})
+            return await websocket.close()
+        try:
+            while True:
+                header, body = await receive_message(websocket)
+                if "Endpoints" not in websocket.headers and header.get("endpoint_choosen") in ["initialize_shard", "return_response", "disconnect_shard", "update_shard", "invalidate_cache", "publish"]:
+                    if header.get("endpoint_choosen") == "initialize_shard":
+                        result = await shards_manager.initialize_shard(websocket=websocket, header=header, body=body)
+                        if result != 200:
+                            break
+                    else:
+                        if header.get("endpoint_choosen") == "disconnect_shard":
+                            await shards_manager.disconnect_shard(websocket=websocket, header=header, body=body)
+                            break
+                        elif header.get("endpoint_choosen") == "update_shard":
+                            await shards_manager.update_shard(websocket=websocket, header=header, body=body)
+                        elif header.get("endpoint_choosen") == "invalidate_cache":
+                            await shards_manager.invalidate_cache(websocket=websocket, header=header, body=body)
+                        elif header.get("endpoint_choosen") == "publish":
+                            await shards_manager.publish(websocket=websocket, header=header, body=body)
+                        else:
+                            await shards_manager.return_response(websocket=websocket, header=header, body=body)
+                elif websocket.state.peer:
+                    # a peer forwards requests like a client and announces the shards connected to it
+                    if header.get("endpoint_choosen") == "peer_sync":
+                        await shards_manager.peer_sync(websocket=websocket, header=header, body=body)
+                    elif header.get("endpoint_choosen") == "publish":
+                        await shards_manager.publish(websocket=websocket, header=header, body=body)
+                    elif header.get("endpoint_choosen") == "cancel_request":
+                        await shards_manager.cancel_request(websocket=websocket, request_id=header.get("request_id"))
+                    elif header.get("endpoint_choosen") == "stream_credit":
+                        await shards_manager.stream_credit(websocket=websocket, request_id=header.get("request_id"), credit=header.get("credit", 1))
+                    else:
+                        await shards_manager.create_request(websocket=websocket, header=header, body=body)
+                elif "Endpoints" in websocket.headers and websocket.headers["Endpoints"] == "create_request":
+                    # errors are answered per request, so the other requests sharing this connection keep going
+                    if "connection_test" in header:
+                        await shards_manager.send_response(websocket, {"message": "Successful connection", "code": 200}, header.get("request_id"))
+                    elif header.get("endpoint_choosen") == "cancel_request":
+                        await shards_manager.cancel_request(websocket=websocket, request_id=header.get("request_id"))
+                    elif header.get("endpoint_choosen") == "stream_credit":
+                        await shards_manager.stream_credit(websocket=websocket, request_id=header.get("request_id"), credit=header.get("credit", 1))
+                    elif header.get("endpoint_choosen") == "subscribe":
+                        await shards_manager.subscribe(websocket=websocket, header=header, body=body)
+                    elif websocket.headers["identifier"] == "all":
+                        shards_manager.start_broadcast(websocket=websocket, header=header, body=body)
+                    else:
+                        await shards_manager.create_request(websocket=websocket, header=header, body=body)
+                else:
+                    await send_message(websocket, {"message": "Endpoint unknown", "code": 500})
+                    return await websocket.close()
+        except WebSocketDisconnect:
+            await shards_manager.disconnect(websocket=websocket)
+
+    def run(self, **kwargs: Any) -> None:
+        """Serves the cluster until the process is stopped, `kwargs` are given to `uvicorn.run`."""
+        import uvicorn
+
+        kwargs.setdefault("loop", "auto" if self.uvloop is None else ("uvloop" if self.uvloop else "asyncio"))
+        if self.unix_socket is not None:
+            kwargs.setdefault("uds", self.unix_socket)
+        else:
+            kwargs.setdefault("host", self.host)
+            kwargs.setdefault("port", self.port)
+        if not self.reuse_port and self.peer_port is None:
+            return uvicorn.run(self.app, **kwargs)
+
+        # the sockets are bound here, uvicorn cannot set SO_REUSEPORT nor listen twice
+        # (and ignores `uds` once it is given sockets)
+        sockets = []
+        if self.unix_socket is None:
+            sockets.append(self.bind(self.host, self.port, self.reuse_port))
+        else:
+            sockets.append(self.bind_unix(self.unix_socket))
+        if self.peer_port is not None:
+            sockets.append(self.bind(self.host, self.peer_port))
+        server = uvicorn.Server(uvicorn.Config(self.app, **kwargs))
+        server.run(sockets=sockets)
+
+    @staticmethod
+    def bind(host: str, port: int, reuse_port: bool = False) -> socket.socket:
+        sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            # every process bound this way gets its share of the new connections from the kernel
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind((host, port))
+        sock.set_inheritable(True)
+        return sock
+
+    @staticmethod
+    def bind_unix(path: str) -> socket.socket:
+        # a socket file left by a cluster that did not stop cleanly would fail the bind
+        if os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+            os.unlink(path)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(path)
+        os.chmod(path, 0o666)
+        sock.set_inheritable(True)
+        return sock
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(prog="better-cluster", description="Runs the cluster shards and clients connect to.")
+    parser.add_argument("--host", default="0.0.0.0", help="the interface to listen on (default: %(default)s)")
+    parser.add_argument("--port", type=int, default=9999, help="the port to listen on (default: %(default)s)")
+    parser.add_argument("--unix-socket", default=os.environ.get("CLUSTER_UNIX_SOCKET"), help="listen on this Unix socket instead of TCP")
+    parser.add_argument("--secret-key", default=os.environ.get("CLUSTER_SECRET_KEY"), help="the key shards and clients must present")
+    parser.add_argument("--registry", default="db/registry.json", help="where the endpoints of the shards are saved (default: %(default)s)")
+    parser.add_argument("--broadcast-timeout", type=float, default=30.0, help="seconds to wait for every shard (default: %(default)s)")
+    parser.add_argument("--cache-size", type=int, default=1024, help="the number of cached responses (default: %(default)s)")
+    parser.add_argument("--uvloop", action=argparse.BooleanOptionalAction if hasattr(argparse, "BooleanOptionalAction") else "store_true", default=None, help="run on uvloop (default: when installed)")
+    parser.add_argument("--peers", default="", help="comma separated urls of the other clusters of the deployment")
+    parser.add_argument("--advertise", help="the url the peers reach this cluster at (default: built from the host and the ports)")
+    parser.add_argument("--peer-port", type=int, help="also listen on this port, for the peers")
+    parser.add_argument("--reuse-port", action="store_true", help="share the port with other clusters of this machine (SO_REUSEPORT)")
+    parser.add_argument("--no-metrics", action="store_true", help="do not serve the metrics on /metrics")
+    parser.add_argument("--log-level", default="info", help="the uvicorn log level (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    server = ClusterServer(
+        secret_key=args.secret_key,
+        host=args.host,
+        port=args.port,
+        unix_socket=args.unix_socket,
+        registry_path=args.registry,
+        broadcast_timeout=args.broadcast_timeout,
+        cache_size=args.cache_size,
+        uvloop=args.uvloop,
+        peers=[url for url in args.peers.split(",") if url],
+        advertise=args.advertise,
+        peer_port=args.peer_port,
+        reuse_port=args.reuse_port,
+        metrics=not args.no_metrics,
+    )
+    server.run(log_level=args.log_level)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,28 @@
 from __future__ import annotations
 
+import time
 import asyncio
-import json
+import inspect
 import logging
 
-from websockets.client import connect
+from concurrent.futures import Executor, ThreadPoolExecutor
+from functools import partial
+from websockets.client import connect, unix_connect
 from discord.ext.commands import Bot, Cog, AutoShardedBot
+from .cache import ResponseCache, cache_key
+from .codec import JSON, Codec, from_subprotocol, subprotocols
+from .coalesce import SingleFlight
 from .errors import NotConnected
+from .metrics import REGISTRY
 from .objects import ClientPayload
+from .protocol import pack, unpack
+from .routes import get_options
+from .shm import SharedBodies
+from .tracing import mark
+from .transport import split_unix_url, unix_url
 from websockets.server import WebSocketServerProtocol
 from websockets.exceptions import InvalidHandshake, ConnectionClosed
-from typing import TYPE_CHECKING, Any, Tuple, Optional, Callable, TypeVar, Dict, Union, List
+from typing import TYPE_CHECKING, Any, Tuple, Optional, Callable, TypeVar, Dict, Set, Union, List
 
 if TYPE_CHECKING:
     from typing_extensions import ParamSpec, TypeAlias
@@ -20,6 +32,14 @@ if TYPE_CHECKING:
     
     RouteFunc: TypeAlias = Callable[P, T]
 
+REQUEST_SECONDS = REGISTRY.histogram("cluster_shard_request_seconds", "Time the shard took to handle a request.", ("endpoint",))
+INFLIGHT = REGISTRY.gauge("cluster_shard_inflight_requests", "Requests being handled by the shard.", ("endpoint",))
+QUEUED = REGISTRY.gauge("cluster_shard_queued_requests", "Requests waiting for a worker in worker-pool mode.")
+SENT_BYTES = REGISTRY.counter("cluster_shard_sent_bytes_total", "Bytes sent to the cluster.")
+RECEIVED_BYTES = REGISTRY.counter("cluster_shard_received_bytes_total", "Bytes received from the cluster.")
+TIMEOUTS = REGISTRY.counter("cluster_shard_timeouts_total", "Requests dropped or answered once their deadline passed.", ("endpoint",))
+ERRORS = REGISTRY.counter("cluster_shard_errors_total", "Requests answered with a 5xx code other than 504.", ("endpoint", "code"))
+
 
 class Shard:
     """|class|
@@ -34,13 +54,38 @@ class Shard:
     identifier: `str | int`
         This is how the bot will be identified in the cluster
     host: `str`
-        The host of the cluster
+        The host of the cluster, a full url such as `ws+unix:///run/cluster.sock` is used as is
     port: `int`
         The port of the cluster
     secret_key: `str`
         Used for authentication when handling requests.
     endpoints_list: `list`
-        The list of all endpoints.
+        The list of all endpoints, as `(name, func)` or `(name, func, options)` tuples.
+        A route written as an async generator streams each chunk it yields in its own frame.
+    codecs: `list`
+        The wire codecs offered to the cluster, most preferred first (the default is every installed codec).
+    max_concurrency: `int`
+        Enables the worker-pool mode: at most this many requests are handled at once,
+        the others wait in a queue (the default is `None`, one task per request).
+    max_queue: `int`
+        The number of requests that can wait in worker-pool mode, once it is full
+        requests are rejected with code `503` (the default is `100`).
+    endpoint_limits: `dict`
+        The maximum number of concurrent calls per endpoint name.
+    executor: `concurrent.futures.Executor`
+        Where routes marked with `offload` run (the default is the event loop's default executor).
+    cache_size: `int`
+        Also caches the routes marked with `cache` inside the shard, keeping at most
+        this many responses (the default is `None`, only the cluster caches them).
+    unix_socket: `str`
+        The path of the Unix socket the cluster listens on when it runs on the same machine,
+        `host` and `port` are ignored then (the default is `None`).
+    shared_memory: `bool`
+        Large responses to clients of the same machine that asked for it go through shared memory
+        instead of the websockets, above the size threshold given by the client (the default is `False`).
+    replica: `bool`
+        Lets several processes running the same routes connect with this identifier, the cluster sends each
+        request to the one with the fewest requests in flight and to another one if it drops (the default is `False`).
     """
 
     __slots__: Tuple[str] = (
@@ -54,6 +99,25 @@ class Shard:
         "websocket", 
         "task",
         "pending_closing",
+        "codecs",
+        "codec",
+        "routes",
+        "max_concurrency",
+        "max_queue",
+        "queue",
+        "queued",
+        "workers",
+        "endpoint_limits",
+        "semaphores",
+        "executor",
+        "options",
+        "handlers",
+        "cache",
+        "flights",
+        "unix_socket",
+        "shared",
+        "credits",
+        "replica",
     )
 
     endpoints: Dict[str, Dict[str, Dict[str, Tuple[Union[int, str], RouteFunc]]]] = {}
@@ -66,6 +130,15 @@ class Shard:
         host: str = "127.0.0.1",
         port: int = 20000,
         secret_key: str = None,
+        codecs: Optional[List[str]] = None,
+        max_concurrency: Optional[int] = None,
+        max_queue: int = 100,
+        endpoint_limits: Optional[Dict[str, int]] = None,
+        executor: Optional[Executor] = None,
+        cache_size: Optional[int] = None,
+        unix_socket: Optional[str] = None,
+        shared_memory: bool = False,
+        replica: bool = False,
     ) -> None:
         self.bot = bot
         self.identifier = identifier
@@ -77,38 +150,243 @@ class Shard:
         self.websocket: WebSocketServerProtocol = None
         self.task: asyncio.Task = None
         self.pending_closing: bool = False
+        self.codecs = codecs
+        self.codec: Optional[Codec] = None
+        self.routes: Dict[str, partial] = {}
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue: Optional[asyncio.Queue] = None
+        # the requests waiting in the queue, a cancelled one is removed so the workers skip it
+        self.queued: Set[str] = set()
+        self.workers: List[asyncio.Task] = []
+        self.endpoint_limits: Dict[str, int] = endpoint_limits or {}
+        self.semaphores: Dict[str, asyncio.Semaphore] = {}
+        self.executor = executor
+        self.options: Dict[str, Dict[str, Any]] = {}
+        self.handlers: Dict[str, asyncio.Task] = {}
+        self.cache: Optional[ResponseCache] = ResponseCache(cache_size) if cache_size else None
+        self.flights = SingleFlight()
+        self.unix_socket = unix_socket
+        self.shared: Optional[SharedBodies] = SharedBodies() if shared_memory else None
+        self.credits: Dict[str, asyncio.Semaphore] = {}
+        self.replica = replica
+        self.__hook_cogs__()
 
     def __repr__(self) -> str:
         return f"<{self.__class__.__name__} connected={self.connected}>"
 
-    def __find_cls__(self, func: str) -> Union[Bot, Cog]:
+    def __hook_cogs__(self) -> None:
+        add_cog, remove_cog = self.bot.add_cog, self.bot.remove_cog
+
+        async def hooked_add_cog(cog: Cog, /, *args: Any, **kwargs: Any) -> None:
+            await add_cog(cog, *args, **kwargs)
+            self.add_cog_routes(cog)
+
+        async def hooked_remove_cog(name: str, /, *args: Any, **kwargs: Any) -> Optional[Cog]:
+            cog = await remove_cog(name, *args, **kwargs)
+            if cog is not None:
+                self.remove_cog_routes(cog)
+            return cog
+
+        self.bot.add_cog = hooked_add_cog
+        self.bot.remove_cog = hooked_remove_cog
+
+    def __find_cls__(self, endpoint: str, exclude: Optional[Cog] = None) -> Union[Bot, Cog]:
         for cog in self.bot.cogs.values():
-            if func in dir(cog):
+            if cog is not exclude and endpoint in dir(cog):
                 return cog
         return self.bot
 
+    def build_routes(self) -> None:
+        """Resolves every endpoint once into a callable bound to the cog (or bot) that owns it."""
+        cogs = [(cog, set(dir(cog))) for cog in self.bot.cogs.values()]
+        self.routes = {}
+        self.options = {}
+        for route in self.endpoints_list:
+            endpoint, func = route[0], route[1]
+            owner = next((cog for cog, names in cogs if endpoint in names), self.bot)
+            self.routes[endpoint] = partial(func, owner)
+            self.options[endpoint] = get_options(route)
+        for endpoint, limit in self.endpoint_limits.items():
+            if endpoint not in self.semaphores:
+                self.semaphores[endpoint] = asyncio.Semaphore(limit)
+
+    def add_cog_routes(self, cog: Cog) -> None:
+        # a new cog comes last in `bot.cogs`, it can only take over routes that fell back to the bot
+        names = set(dir(cog))
+        for endpoint, route in self.routes.items():
+            if route.args[0] is self.bot and endpoint in names:
+                self.routes[endpoint] = partial(route.func, cog)
+
+    def remove_cog_routes(self, cog: Cog) -> None:
+        for endpoint, route in self.routes.items():
+            if route.args[0] is cog:
+                self.routes[endpoint] = partial(route.func, self.__find_cls__(endpoint, exclude=cog))
+
     @property
     def connected(self) -> bool:
         return self.websocket is not None
 
     @property
     def base_url(self) -> str:
+        if self.unix_socket is not None:
+            return unix_url(self.unix_socket)
+        if "://" in self.host:
+            return self.host
         return f"ws://{self.host}:{self.port}"
 
+    def encode(self, header: Dict[str, Any], body: Optional[Any] = None) -> Union[str, bytes]:
+        if self.codec is not None:
+            return pack(header, b"" if body is None else self.codec.dumps(body))
+        elif body is None:
+            return JSON.dumps_text(header)
+        else:
+            return JSON.dumps_text({**header, "response": body})
+
+    async def send(self, header: Dict[str, Any], body: Optional[Any] = None) -> None:
+        frame = self.encode(header, body)
+        await self.websocket.send(frame)
+        SENT_BYTES.inc(value=len(frame))
+
+    async def run_in_executor(self, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """|coro|
+
+        Runs the heavy part of a route in the shard's executor, keeping the event loop responsive.
+
+        """
+        return await asyncio.get_running_loop().run_in_executor(self.executor, partial(func, *args, **kwargs))
+
+    def decode(self, raw: Union[str, bytes]) -> Dict[str, Any]:
+        if isinstance(raw, str) or self.codec is None:
+            return JSON.loads(raw)
+
+        header, body = unpack(raw)
+        if body:
+            header["data"] = self.codec.loads(body)
+        return header
+
+    async def open_websocket(self) -> None:
+        url, path = split_unix_url(self.base_url)
+        options = {
+            "subprotocols": subprotocols(self.codecs),
+            "extra_headers": {
+                "Secret-Key": str(self.secret_key),
+                "Bot-ID": str(self.bot.user.id),
+                "Identifier": str(self.identifier)
+            }
+        }
+        if path is None:
+            self.websocket = await connect(url, **options)
+        else:
+            self.websocket = await unix_connect(path, url, **options)
+        self.codec = from_subprotocol(self.websocket.subprotocol)
+
     async def handle_request(self, request: Dict) -> None:
         self.logger.debug(f"Received request: {request!r}")
 
+        endpoint = "batch" if request.get("batch") else str(request.get("endpoint"))
+        INFLIGHT.inc(endpoint)
+        start = time.perf_counter()
+        if (trace := request.get("trace")) is not None:
+            mark(trace, "shard", "started")
+        try:
+            if request.get("batch"):
+                response = await self.process_batch(request)
+            elif (route := self.routes.get(request.get("endpoint"))) is not None and inspect.isasyncgenfunction(route.func):
+                return await self.stream_response(request, route)
+            else:
+                response = await self.process_request(request)
+            if response is not None:
+                await self.respond(request, response)
+            else:
+                TIMEOUTS.inc(endpoint)
+        finally:
+            INFLIGHT.dec(endpoint)
+            REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint)
+
+    async def stream_response(self, request: Dict, route: partial) -> None:
         endpoint: str = request.get("endpoint")
-        identifier: str = request.get("identifier")
+        deadline: Optional[float] = request.get("deadline")
+        header = {"endpoint_choosen": "return_response", "identifier": str(self.identifier), "uuid": request.get("uuid")}
 
-        identifier, func = self.endpoints[str(self.bot.user.id)][str(identifier)].get(endpoint)
-        cls = self.__find_cls__(endpoint)
-        
-        arguments = (cls, ClientPayload(request))
+        # the client grants credits as it consumes the chunks, so a slow reader slows the route down
+        credits = None
+        if (window := request.get("window")) and (ID := request.get("uuid")) is not None:
+            credits = self.credits[ID] = asyncio.Semaphore(window)
+
+        chunks = route(ClientPayload(request))
+        seq = 0
+        try:
+            async for chunk in chunks:
+                if credits is not None:
+                    await credits.acquire()
+                if deadline is not None and deadline <= time.time():
+                    TIMEOUTS.inc(endpoint)
+                    return self.logger.debug(f"Dropping stream of {endpoint!r}, its deadline passed.")
+                if self.websocket is None:
+                    return self.logger.warning(f"Dropping stream of {endpoint!r}, the shard is not connected.")
+                await self.send({**header, "seq": seq, "code": 200}, chunk)
+                seq += 1
+        except ConnectionClosed:
+            return self.logger.warning(f"Dropping stream of {endpoint!r}, the connection was closed.")
+        except Exception as exception:
+            self.bot.dispatch("shard_error", endpoint, exception)
+            self.logger.error(f"Received error while streaming {endpoint!r}", exc_info=exception)
+            response = {"error": "Something went wrong while streaming the route!", "code": 500}
+        else:
+            response = {"done": True, "chunks": seq, "code": 200}
+        finally:
+            self.credits.pop(request.get("uuid"), None)
+            await chunks.aclose()
+
+        await self.respond(request, response)
+
+    def grant(self, ID: Optional[str], credit: int) -> None:
+        if (credits := self.credits.get(ID)) is not None:
+            for _ in range(credit):
+                credits.release()
+
+    async def process_batch(self, request: Dict) -> Dict[str, Any]:
+        calls: List[Dict[str, Any]] = (request.get("data") or {}).get("calls", [])
+        responses = await asyncio.gather(*(
+            self.process_request({"endpoint": call.get("endpoint"), "data": call.get("data") or {}, "deadline": request.get("deadline")})
+            for call in calls
+        ))
+        return {
+            "responses": [
+                {"error": "The request timed out!", "code": 504} if response is None else response
+                for response in responses
+            ],
+            "code": 200,
+        }
+
+    async def process_request(self, request: Dict) -> Optional[Dict[str, Any]]:
+        """Calls the route of a request and returns its response, `None` when the request has to be dropped."""
+        endpoint: str = request.get("endpoint")
+        deadline: Optional[float] = request.get("deadline")
+
+        ttl: Optional[float] = self.options.get(endpoint, {}).get("cache")
+        coalesce = self.coalesces(endpoint)
+        key = cache_key(endpoint, data=request.get("data")) if ttl or coalesce else None
+        if ttl and self.cache is not None:
+            version = self.cache.version
+            if (cached := self.cache.get(key)) is not None:
+                return cached
 
         try:
-            response: Optional[Union[Dict, Any]] = await func(*arguments)
+            if (route := self.routes.get(endpoint)) is None:
+                response = {"error": f"Unknown endpoint {endpoint!r}!", "code": 404}
+            elif coalesce:
+                # identical requests already running share the result of the first one
+                response = await self.flights.run(key, partial(self.run_route, endpoint, route, request, deadline))
+            else:
+                response: Optional[Union[Dict, Any]] = await self.run_route(endpoint, route, request, deadline)
         except Exception as exception:
+            # a route timing out on its own (`bot.wait_for`, ...) is answered like any other error
+            if isinstance(exception, asyncio.TimeoutError) and deadline is not None and time.time() >= deadline:
+                # the cluster already answered the client once the deadline passed
+                self.logger.debug(f"Dropping request to {endpoint!r}, its deadline passed.")
+                return None
             self.bot.dispatch("shard_error", endpoint, exception)
             self.logger.error(f"Received error while executing {endpoint!r}", exc_info=exception)
             response = {
@@ -126,11 +404,154 @@ class Shard:
         if not response.get("code"):
             response["code"] = 200
 
-        response_finaly = {'endpoint_choosen': "return_response", "identifier": str(identifier), "uuid": request.get("uuid"), 'response': response}
+        if ttl and self.cache is not None and response["code"] == 200:
+            self.cache.set(key, response, ttl, version)
+
+        return response
+
+    def coalesces(self, endpoint: str) -> bool:
+        options = self.options.get(endpoint, {})
+        return bool(options.get("coalesce", options.get("cache")))
+
+    async def run_route(self, endpoint: str, route: partial, request: Dict, deadline: Optional[float] = None) -> Optional[Union[Dict, Any]]:
+        if (limit := self.semaphores.get(endpoint)) is not None:
+            async with limit:
+                return await self.call_route(endpoint, route, ClientPayload(request), deadline)
+        return await self.call_route(endpoint, route, ClientPayload(request), deadline)
 
-        await self.websocket.send(json.dumps(response_finaly, separators=(", ", ": ")))
+    async def call_route(
+        self, 
+        endpoint: str, 
+        route: partial, 
+        payload: ClientPayload, 
+        deadline: Optional[float] = None
+    ) -> Optional[Union[Dict, Any]]:
+        if self.options[endpoint].get("offload"):
+            # the bot and its cogs cannot leave the process, offloaded routes only get the request data
+            coro = self.run_in_executor(route.func, payload.data)
+        else:
+            coro = route(payload)
+        if deadline is None:
+            return await coro
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            coro.close()
+            raise asyncio.TimeoutError
+        return await asyncio.wait_for(coro, remaining)
+
+    async def respond(self, request: Dict, response: Dict) -> None:
+        header = {
+            'endpoint_choosen': "return_response", 
+            "identifier": str(self.identifier), 
+            "uuid": request.get("uuid"), 
+            "code": response.get("code", 200),
+        }
+        endpoint = "batch" if request.get("batch") else str(request.get("endpoint"))
+        if (code := int(header["code"])) == 504:
+            TIMEOUTS.inc(endpoint)
+        elif code >= 500:
+            ERRORS.inc(endpoint, str(code))
+        if (trace := request.get("trace")) is not None:
+            mark(trace, "shard", "finished")
+            header["trace"] = trace
+
+        offload = self.options.get(request.get("endpoint"), {}).get("offload_encode")
+        threshold: Optional[int] = request.get("shm")
+        if threshold is not None and self.shared is not None and self.codec is not None:
+            # the body is encoded alone, so a large one can be moved to shared memory
+            raw = await self.run_encoder(offload, self.codec.dumps, response)
+            if len(raw) >= threshold:
+                header["shm"] = self.shared.write(raw, self.codec)
+                raw = b""
+            frame = pack(header, raw)
+        else:
+            frame = await self.run_encoder(offload, self.encode, header, response)
+
+        delivered = False
+        if self.websocket is None:
+            self.logger.warning(f"Dropping response to {request.get('endpoint')!r}, the shard is not connected.")
+        else:
+            try:
+                await self.websocket.send(frame)
+                SENT_BYTES.inc(value=len(frame))
+                delivered = True
+            except ConnectionClosed:
+                self.logger.warning(f"Dropping response to {request.get('endpoint')!r}, the connection was closed.")
+        if not delivered:
+            if "shm" in header:
+                self.shared.release(header["shm"]["name"])
+            return
         self.logger.debug(f"Sending response: {response!r}")
 
+    async def run_encoder(self, offload: bool, func: Callable[..., T], *args: Any) -> T:
+        if not offload:
+            return func(*args)
+        executor = self.executor if isinstance(self.executor, ThreadPoolExecutor) else None
+        return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+
+    def start_handler(self, request: Dict) -> asyncio.Task:
+        task = asyncio.create_task(self.handle_request(request))
+        if (ID := request.get("uuid")) is not None:
+            self.handlers[ID] = task
+            task.add_done_callback(lambda _: self.handlers.pop(ID, None))
+        return task
+
+    def cancel_handler(self, ID: Optional[str]) -> None:
+        if ID in self.queued:
+            self.logger.debug(f"Dropping queued request {ID!r}, the client gave up.")
+            self.queued.discard(ID)
+            return
+        if (task := self.handlers.pop(ID, None)) is not None:
+            self.logger.debug(f"Cancelling request {ID!r}, the client gave up.")
+            task.cancel()
+
+    def dispatch_request(self, request: Dict) -> None:
+        if request.get("endpoint_choosen") == "cancel_request":
+            return self.cancel_handler(request.get("uuid"))
+        if request.get("endpoint_choosen") == "stream_credit":
+            return self.grant(request.get("uuid"), int(request.get("credit", 1)))
+        if (trace := request.get("trace")) is not None:
+            mark(trace, "shard", "received")
+
+        if self.max_concurrency is None:
+            self.start_handler(request)
+            return
+
+        try:
+            self.queue.put_nowait(request)
+            QUEUED.set(value=self.queue.qsize())
+            if (ID := request.get("uuid")) is not None:
+                self.queued.add(ID)
+        except asyncio.QueueFull:
+            self.logger.warning(f"Rejecting request to {request.get('endpoint')!r}, the queue is full.")
+            asyncio.create_task(self.respond(request, {"error": "The shard is busy, try again later!", "code": 503}))
+
+    async def worker(self) -> None:
+        while True:
+            request = await self.queue.get()
+            QUEUED.set(value=self.queue.qsize())
+            if (ID := request.get("uuid")) is not None:
+                if ID not in self.queued:
+                    self.queue.task_done()
+                    continue
+                self.queued.discard(ID)
+            try:
+                # waiting on the handler task keeps a cancelled request from cancelling the worker
+                await asyncio.wait({self.start_handler(request)})
+            except Exception as exception:
+                self.logger.error("Worker failed to handle a request", exc_info=exception)
+            finally:
+                self.queue.task_done()
+
+    def start_workers(self) -> None:
+        if self.max_concurrency is None:
+            return
+        if self.queue is None:
+            self.queue = asyncio.Queue(maxsize=self.max_queue)
+        self.workers = [x for x in self.workers if not x.done()]
+        for _ in range(self.max_concurrency - len(self.workers)):
+            self.workers.append(asyncio.create_task(self.worker()))
+
     async def wait_for_requests(self) -> None:
         while True:
             try:
@@ -141,40 +562,29 @@ class Shard:
                     asyncio.create_task(self.reconnect())
                 break
             else:
-                data: Dict = json.loads(raw)
-                asyncio.create_task(self.handle_request(data))
+                RECEIVED_BYTES.inc(value=len(raw))
+                data: Dict = self.decode(raw)
+                self.dispatch_request(data)
 
     async def reconnect(self) -> None:
         while True:
             if self.connected:
                 break
             try:
-                self.websocket = await connect(
-                    self.base_url,
-                    extra_headers={
-                        "Secret-Key": str(self.secret_key),
-                        "Bot-ID": str(self.bot.user.id),
-                        "Identifier": str(self.identifier)
-                    }
-                )
-            except (ConnectionRefusedError, InvalidHandshake):
+                await self.open_websocket()
+            except (ConnectionRefusedError, FileNotFoundError, InvalidHandshake):
                 self.websocket = None
                 self.logger.critical("Failed to connect to the cluster!")
             else:
                 self.pending_closing = False
-                await self.websocket.send(
-                    json.dumps({
-                        "endpoint_choosen": "initialize_shard",
-                        "response": {
-                            "endpoints": []
-                        }
-                    })
-                )
-                message: Dict[str, Any] = json.loads(await self.websocket.recv())
+                await self.send({"endpoint_choosen": "initialize_shard"}, {"endpoints": [], "replica": self.replica})
+                message: Dict[str, Any] = self.decode(await self.websocket.recv())
                 if message["code"] == 200:
+                    self.start_workers()
                     self.task = asyncio.Task(self.wait_for_requests())
                     self.logger.info("Successfully connected to the cluster!")
                     if self.bot.is_ready():
+                        await self.send_shard_map()
                         self.bot.dispatch("shard_ready")
                     else:
                         asyncio.create_task(self.wait_bot_is_ready())
@@ -187,15 +597,8 @@ class Shard:
         
         """
         try:
-            self.websocket = await connect(
-                self.base_url,
-                extra_headers={
-                    "Secret-Key": str(self.secret_key),
-                    "Bot-ID": str(self.bot.user.id),
-                    "Identifier": str(self.identifier)
-                }
-            )
-        except (ConnectionRefusedError, InvalidHandshake):
+            await self.open_websocket()
+        except (ConnectionRefusedError, FileNotFoundError, InvalidHandshake):
             return self.logger.critical("Failed to connect to the cluster!")
         else:
             self.pending_closing = False
@@ -204,19 +607,23 @@ class Shard:
             self.endpoints[str(self.bot.user.id)][str(self.identifier)] = {}
             for x in self.endpoints_list:
                 self.endpoints[str(self.bot.user.id)][str(self.identifier)][f"{x[0]}"] = (str(self.identifier), x[1])
-            await self.websocket.send(
-                json.dumps({
-                    "endpoint_choosen": "initialize_shard",
-                    "response": {
-                        "endpoints": [x[0] for x in self.endpoints[str(self.bot.user.id)][str(self.identifier)].items()]
-                    }
-                })
+            self.build_routes()
+            await self.send(
+                {"endpoint_choosen": "initialize_shard"},
+                {
+                    "endpoints": [x[0] for x in self.endpoints[str(self.bot.user.id)][str(self.identifier)].items()],
+                    "cache": {endpoint: options["cache"] for endpoint, options in self.options.items() if options.get("cache")},
+                    "coalesce": [endpoint for endpoint in self.options if self.coalesces(endpoint)],
+                    "replica": self.replica,
+                }
             )
-            message: Dict[str, Any] = json.loads(await self.websocket.recv())
+            message: Dict[str, Any] = self.decode(await self.websocket.recv())
             if message["code"] == 200:
+                self.start_workers()
                 self.task = asyncio.Task(self.wait_for_requests())
                 self.logger.info("Successfully connected to the cluster!")
                 if self.bot.is_ready():
+                    await self.send_shard_map()
                     self.bot.dispatch("shard_ready")
                 else:
                     asyncio.create_task(self.wait_bot_is_ready())
@@ -232,16 +639,77 @@ class Shard:
 
         if self.websocket:
             self.pending_closing = True
-            await self.websocket.send(
-                json.dumps({
-                    "endpoint_choosen": "disconnect_shard",
-                })
-            )
+            await self.send({
+                "endpoint_choosen": "disconnect_shard",
+            })
             self.logger.info("Successfully disconnected to the cluster!")
             await self.websocket.close()
+            for worker in self.workers:
+                worker.cancel()
+            self.workers.clear()
+            if self.shared is not None:
+                self.shared.close()
         else:
             raise NotConnected
 
+    async def invalidate(self, endpoint: Optional[str] = None, **kwargs: Any) -> None:
+        """|coro|
+
+        Drops cached responses once the data behind them changed, on the cluster and in this shard.
+
+        Parameters:
+        ----------
+        endpoint: `str`
+            The endpoint whose responses are dropped (the default is every endpoint of this shard).
+        **kwargs: `Any`
+            Only drop the response cached for this request data.
+        """
+        data = kwargs or None
+        if self.cache is not None:
+            self.cache.invalidate(*(() if endpoint is None else (endpoint,)), data=data)
+        if self.websocket is not None:
+            await self.send({"endpoint_choosen": "invalidate_cache", "endpoint": endpoint}, data)
+
+    async def publish(self, topic: str, data: Any = None) -> None:
+        """|coro|
+
+        Pushes an event to the clients subscribed to `topic` for this bot, see :meth:`Client.subscribe`.
+        Events published while the shard is not connected to the cluster are lost.
+
+        Parameters:
+        ----------
+        topic: `str`
+            The topic of the event.
+        data: `Any`
+            The content of the event, anything the wire codec can encode.
+        """
+        if self.websocket is None:
+            return
+        try:
+            await self.send({"endpoint_choosen": "publish", "topic": topic}, data)
+        except ConnectionClosed:
+            self.logger.debug(f"Event of the topic {topic!r} lost, the shard is disconnected")
+
     async def wait_bot_is_ready(self) -> None:
         await self.bot.wait_until_ready()
+        await self.send_shard_map()
         self.bot.dispatch("shard_ready")
+
+    def shard_map(self) -> Dict[str, Any]:
+        """Returns the Discord shards handled by this process, only accurate once the bot is ready."""
+        shard_ids = getattr(self.bot, "shard_ids", None)
+        if shard_ids is None and isinstance(self.bot, AutoShardedBot):
+            # without explicit ids an auto sharded bot runs every shard
+            shard_ids = list(self.bot.shards) or range(self.bot.shard_count or 1)
+        elif shard_ids is None:
+            shard_ids = [self.bot.shard_id or 0]
+        return {"shard_ids": list(shard_ids), "shard_count": self.bot.shard_count or 1}
+
+    async def send_shard_map(self) -> None:
+        """|coro|
+
+        Reports the Discord shards of this process, so the cluster can route requests by guild.
+
+        """
+        if self.websocket is not None:
+            await self.send({"endpoint_choosen": "update_shard"}, self.shard_map())
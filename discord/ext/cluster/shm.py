@@ -0,0 +1,113 @@
+"""
+Shared memory fast path for large bodies between processes of the same machine.
+
+Instead of going through the websockets, a large body is written once into a
+shared memory segment and only a small descriptor travels with the frame::
+
+    {"name": "psm_1a2b3c", "size": 4194304, "codec": "msgpack"}
+
+The reader decodes the body straight from the mapping and releases the segment,
+the writer releases the segments nobody read after `ttl` seconds.
+"""
+
+from __future__ import annotations
+
+import asyncio
+
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Dict, Optional, Tuple
+
+from .codec import Buffer, Codec, get_codec
+
+try:
+    import _posixshmem
+except ImportError:  # pragma: no cover
+    _posixshmem = None
+
+__all__ = ("SharedBodies", "read")
+
+
+def _open(name: Optional[str] = None, size: int = 0) -> SharedMemory:
+    # the segments are released by this module, the resource tracker would unlink them too early
+    # (or warn about them) when the process that opened them exits
+    try:
+        return SharedMemory(name, create=name is None, size=size, track=False)
+    except TypeError:  # Python < 3.13 always tracks the segment
+        segment = SharedMemory(name, create=name is None, size=size)
+        if _posixshmem is not None:
+            resource_tracker.unregister(segment._name, "shared_memory")
+        return segment
+
+
+def _release(segment: SharedMemory) -> None:
+    segment.close()
+    if _posixshmem is not None:
+        try:
+            _posixshmem.shm_unlink(segment._name)
+        except FileNotFoundError:
+            pass
+
+
+class SharedBodies:
+    """|class|
+
+    Writes bodies into shared memory segments and keeps track of them until they are released.
+
+    Parameters:
+    ----------
+    ttl: `float`
+        Seconds after which a segment that was not read is released (the default is `30`).
+    """
+
+    __slots__: Tuple[str, ...] = ("ttl", "segments")
+
+    def __init__(self, ttl: float = 30.0) -> None:
+        self.ttl = ttl
+        # only the names are kept on POSIX, elsewhere closing the last handle would destroy the segment
+        self.segments: Dict[str, Optional[SharedMemory]] = {}
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__} segments={len(self.segments)}>"
+
+    def write(self, data: Buffer, codec: Codec) -> Dict[str, Any]:
+        """Copies already encoded body bytes into a new segment and returns its descriptor."""
+        size = len(data)
+        segment = _open(size=max(size, 1))
+        segment.buf[:size] = data
+        if _posixshmem is not None:
+            # the segment outlives the mapping, this process does not hold the body until the ttl
+            segment.close()
+            self.segments[segment.name] = None
+        else:
+            self.segments[segment.name] = segment
+        asyncio.get_running_loop().call_later(self.ttl, self.release, segment.name)
+        return {"name": segment.name, "size": size, "codec": codec.name}
+
+    def release(self, name: str) -> None:
+        if name not in self.segments:
+            return
+        if (segment := self.segments.pop(name)) is None:
+            try:
+                segment = _open(name)
+            except FileNotFoundError:
+                # already read and released by the client
+                return
+        _release(segment)
+
+    def close(self) -> None:
+        for name in list(self.segments):
+            self.release(name)
+
+
+def read(descriptor: Dict[str, Any]) -> Any:
+    """Decodes a body from its shared memory segment and releases it, raises `FileNotFoundError` if it expired."""
+    segment = _open(descriptor["name"])
+    try:
+        view = segment.buf[:descriptor["size"]]
+        try:
+            return get_codec(descriptor["codec"]).loads(view)
+        finally:
+            view.release()
+    finally:
+        _release(segment)
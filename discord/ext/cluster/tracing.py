@@ -0,0 +1,110 @@
+"""
+Request tracing across the client, cluster and shard hops.
+
+A traced request carries a `trace` context in its header, next to its `uuid`.
+Every hop adds the moments it handled the request and the response brings them back::
+
+    {"id": "4bf92f3577b34da6", "marks": [["client", "start", 1700000000.1234], ["client", "sent", ...], ...]}
+
+The client turns them into a per-hop breakdown, added to the response under `trace`.
+Marks are wall clock times, hops running on other machines are only as precise as
+their clocks are in sync. Requests that are not traced carry nothing and cost a
+single dict lookup per hop.
+"""
+
+from __future__ import annotations
+
+import time
+import random
+import logging
+
+from contextvars import ContextVar
+from uuid import uuid4
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+__all__ = ("Span", "Tracer", "HOPS", "mark", "spans")
+
+# (name, the mark it starts at, the mark it ends at)
+HOPS: Tuple[Tuple[str, Tuple[str, str], Tuple[str, str]], ...] = (
+    ("connect", ("client", "start"), ("client", "sent")),
+    ("client_to_cluster", ("client", "sent"), ("cluster", "received")),
+    ("cluster", ("cluster", "received"), ("cluster", "dispatched")),
+    ("cluster_to_shard", ("cluster", "dispatched"), ("shard", "received")),
+    ("shard_queue", ("shard", "received"), ("shard", "started")),
+    ("handler", ("shard", "started"), ("shard", "finished")),
+    ("shard_to_cluster", ("shard", "finished"), ("cluster", "returned")),
+    ("cluster_to_client", ("cluster", "returned"), ("client", "received")),
+)
+
+# the trace of the request being sent by the current task, set by `Client`
+current: ContextVar[Optional[Dict[str, Any]]] = ContextVar("trace", default=None)
+
+
+class Span(NamedTuple):
+    trace_id: str
+    endpoint: str
+    name: str
+    start: float
+    end: float
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+
+def mark(trace: Dict[str, Any], hop: str, event: str) -> None:
+    trace["marks"].append([hop, event, time.time()])
+
+
+def spans(trace: Dict[str, Any], endpoint: str = "") -> List[Span]:
+    """The hops of a trace, the ones a request did not go through (a cached answer, an error) are left out."""
+    marks = {(hop, event): at for hop, event, at in trace.get("marks", ())}
+    found = []
+    for name, start, end in HOPS:
+        if start in marks and end in marks:
+            found.append(Span(trace["id"], endpoint, name, marks[start], marks[end]))
+    if ("client", "start") in marks and ("client", "received") in marks:
+        found.append(Span(trace["id"], endpoint, "total", marks[("client", "start")], marks[("client", "received")]))
+    return found
+
+
+class Tracer:
+    """|class|
+
+    Traces the requests of a :class:`Client`.
+
+    Parameters:
+    ----------
+    sample_rate: `float`
+        The share of requests that are traced, between `0` and `1` (the default is `1`).
+    export: `Callable`
+        Called with the list of :class:`Span` of every traced request, to send them
+        to a tracing backend (the default is `None`, the breakdown is only added to the response).
+    """
+
+    __slots__: Tuple[str, ...] = ("sample_rate", "export", "logger")
+
+    def __init__(self, sample_rate: float = 1.0, export: Optional[Callable[[List[Span]], Any]] = None) -> None:
+        self.sample_rate = sample_rate
+        self.export = export
+        self.logger = logging.getLogger("discord.ext.cluster")
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__} sample_rate={self.sample_rate!r}>"
+
+    def start(self) -> Optional[Dict[str, Any]]:
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return None
+        trace = {"id": uuid4().hex[:16], "marks": []}
+        mark(trace, "client", "start")
+        return trace
+
+    def finish(self, trace: Dict[str, Any], endpoint: str) -> Dict[str, Any]:
+        """Returns the per-hop breakdown of a trace, in seconds, and exports its spans."""
+        found = spans(trace, endpoint)
+        if self.export is not None:
+            try:
+                self.export(found)
+            except Exception as exception:
+                self.logger.error("Failed to export a trace", exc_info=exception)
+        return {"id": trace["id"], "hops": {span.name: span.duration for span in found}}
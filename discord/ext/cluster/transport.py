@@ -0,0 +1,29 @@
+"""
+Helpers for the Unix domain socket transport.
+
+Processes running on the same machine can talk over a Unix socket instead of
+TCP loopback, the protocol spoken on it is exactly the same. Such a cluster is
+addressed with a `ws+unix://` url followed by the socket path, for example
+`ws+unix:///run/cluster.sock`.
+"""
+
+from __future__ import annotations
+
+from typing import Optional, Tuple
+
+__all__ = ("UNIX_SCHEME", "unix_url", "split_unix_url")
+
+UNIX_SCHEME = "ws+unix://"
+
+
+def unix_url(path: str) -> str:
+    """Returns the url of a cluster listening on the Unix socket at `path`."""
+    return f"{UNIX_SCHEME}{path}"
+
+
+def split_unix_url(url: str) -> Tuple[str, Optional[str]]:
+    """Returns the url to handshake with and the Unix socket path, which is `None` for TCP urls."""
+    if url.startswith(UNIX_SCHEME):
+        # the host is only used for the `Host` header of the handshake
+        return "ws://localhost/", url[len(UNIX_SCHEME):]
+    return url, None
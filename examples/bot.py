@@ -3,9 +3,9 @@ import discord
 import logging
 
 from discord.ext import commands
-from typing import Optional
+from typing import Dict, Optional
 
-from discord.ext.cluster import Shard, ClientPayload
+from discord.ext.cluster import Shard, ClientPayload, offload, options
 from discord.ext.cluster.errors import ClusterBaseError
 
 logging.basicConfig(level=logging.INFO)
@@ -17,6 +17,15 @@ logging.getLogger("discord.gateway").disabled = True
 endpoints_list = []
 
 
+@offload
+def build_leaderboard(data: Dict) -> Dict:
+    # runs in the shard's executor instead of the bot's event loop
+    return {"leaderboard": sorted(data["scores"], key=lambda x: x["score"], reverse=True)}
+
+
+endpoints_list.append(("build_leaderboard", build_leaderboard))
+
+
 class MyBot(commands.Bot):
     def __init__(self) -> None:
         intents = discord.Intents.all()
@@ -42,6 +51,25 @@ class MyBot(commands.Bot):
     async def get_user_data(self, data: ClientPayload):
         user = self.get_user(data.user_id)
         return user._to_minimal_user_json()
+
+    @route()
+    @options(cache=30)
+    async def get_guild_data(self, data: ClientPayload):
+        guild = self.get_guild(data.guild_id)
+        return {"name": guild.name, "member_count": guild.member_count}
+
+    @route()
+    async def export_members(self, data: ClientPayload):
+        # every chunk is sent in its own frame, the whole export never sits in memory
+        guild = self.get_guild(data.guild_id)
+        for i in range(0, len(guild.members), 1000):
+            yield {"members": [member._user._to_minimal_user_json() for member in guild.members[i:i + 1000]]}
+
+    async def on_guild_update(self, before: discord.Guild, after: discord.Guild):
+        # the cached `get_guild_data` response of this guild is outdated now
+        await self.shard.invalidate("get_guild_data", guild_id=after.id)
+        # and the clients subscribed to `guild_update` are told right away
+        await self.shard.publish("guild_update", {"guild_id": after.id, "name": after.name})
     
     @bot.event
     async def on_shard_error(self, endpoint: str, error: ClusterBaseError):
@@ -1,4 +1,4 @@
-from quart import Quart
+from quart import Quart, websocket
 from discord.ext.cluster import Client
 
 app = Quart(__name__)
@@ -9,5 +9,23 @@ ipc = Client(host="127.0.0.1", secret_key="secret", standard_port=1025)
 async def main():
     return await ipc.request(endpoint="get_user_data", bot_id=812993088749961236, identifier=1, user_id=383946213629624322)
 
+
+@app.route('/guild/<int:guild_id>')
+async def guild(guild_id: int):
+    # answered by whichever shard handles this guild
+    return await ipc.request_guild(bot_id=812993088749961236, guild_id=guild_id, endpoint="get_guild_data")
+
+
+@app.websocket('/guild_updates')
+async def guild_updates():
+    # pushed by the shards as they happen, only the latest update of each topic is kept for a slow browser
+    async for topic, data in ipc.subscribe(812993088749961236, "guild_update", policy="coalesce"):
+        await websocket.send_json(data)
+
+
+@app.after_serving
+async def close_ipc():
+    await ipc.close()
+
 if __name__ == '__main__':
     app.run(port=8000, debug=True)
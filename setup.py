@@ -53,6 +53,13 @@ setuptools.setup(
     ],
     long_description_content_type="text/markdown",
     install_requires=requirements,
+    extras_require={
+        "speed": ["msgpack>=1.0", "orjson"],
+        "uvloop": ["uvloop"],
+    },
+    entry_points={
+        "console_scripts": ["better-cluster = discord.ext.cluster.server:main"],
+    },
     python_requires=">=3.8.0",
     project_urls={
         "Source": "https://github.com/chredeur0/better-cluster-fastapi",